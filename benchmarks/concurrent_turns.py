@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Eşzamanlı tur ölçümü (ağ çağrısı yok, Stub sağlayıcı ile).
+
+N sohbette aynı anda birer tartışma turu başlatır ve toplam duvar saatini ölçer:
+- bloklayan: senkron SDK çağrısını taklit eder (time.sleep, event loop durur) - async geçişinden önceki hal
+- async: StubProvider (asyncio.sleep) - bugünkü hal
+
+Kullanım:
+    python benchmarks/concurrent_turns.py --turns 20 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bot  # noqa: E402
+
+class BlockingStubProvider(bot.StubProvider):
+    """Senkron istemci gibi: bekleme süresince event loop'u bloklar"""
+    LABEL = "Stub (bloklayan)"
+
+    async def _generate(self, lease, system_prompt, user_message, chat_history, temperature, max_tokens):
+        time.sleep(self.latency)
+        return self._reply(user_message)
+
+async def run_turns(provider: bot.LLMProvider, turns: int, slots: int) -> float:
+    """turns kadar sohbette aynı anda bir tur; toplam süre (saniye)"""
+    bot.providers = [provider]
+    bot.llm_scheduler = bot.LLMScheduler(slots)
+
+    sessions = []
+    for chat_id in range(turns):
+        session = bot.MunazaraSession(chat_id=chat_id, user_position="Deist", bot_position="Ateist", topic="Felsefe")
+        sessions.append(session)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(bot.get_ai_response(s, f"Sohbet {s.chat_id} iddiası") for s in sessions))
+    elapsed = time.perf_counter() - started
+
+    failed = sum(1 for _, model in results if model == "Yok")
+    if failed:
+        print(f"  uyarı: {failed} tur cevapsız kaldı")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="sağlayıcı gecikmesi (saniye)")
+    parser.add_argument("--slots", type=int, default=0, help="LLM zamanlayıcı slotu (0 = tur sayısı)")
+    args = parser.parse_args()
+
+    logging.getLogger("bot").setLevel(logging.WARNING)
+    bot.TURN_BUDGET = max(bot.TURN_BUDGET, args.turns * args.latency * 2)
+    slots = args.slots or args.turns
+
+    print(f"{args.turns} eşzamanlı tur, sağlayıcı gecikmesi {args.latency:g}s, {slots} LLM slotu")
+    for label, provider in (
+        ("bloklayan", BlockingStubProvider("stub", latency=args.latency, timeout=bot.TURN_BUDGET)),
+        ("async", bot.StubProvider("stub", latency=args.latency, timeout=bot.TURN_BUDGET)),
+    ):
+        elapsed = asyncio.run(run_turns(provider, args.turns, slots))
+        print(f"  {label:10s} {elapsed:6.2f}s  (tur başına ort. {elapsed / args.turns:.2f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Ani yük altında Gemini payı simülasyonu (ağ çağrısı yok).
+
+Gemini, sahte bir istemci ve ölçeklenmiş token bucket ile (bir "dakika" --minute
+saniye) çalışır; yedek StubProvider'dır. Turlar --burst'lük dalgalar halinde
+gelir. Aynı yük, farklı RATE_LIMIT_MAX_WAIT değerleriyle koşulur: beklemeye izin
+verilince turlar yedeğe düşmek yerine bucket'ın dolmasını bekler, Gemini payı artar.
+
+Kullanım:
+    python benchmarks/gemini_share.py --waits 0,1,3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import logging
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bot  # noqa: E402
+
+class FakeGeminiModels:
+    """client.aio.models yerine: sabit gecikmeli cevap"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def generate_content(self, model, contents, config):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(text="Gemini cevabı")
+
+def make_key(rpm: float, minute: float, latency: float) -> bot.GeminiKey:
+    """Dakikası minute saniyeye ölçeklenmiş tek anahtar"""
+    limiter = bot.RateLimitTracker(rpm=rpm, rpd=100000)
+    limiter.minute_bucket = bot.TokenBucket(rate=rpm / minute, capacity=rpm)
+    client = SimpleNamespace(aio=SimpleNamespace(models=FakeGeminiModels(latency)))
+    return bot.GeminiKey(key_id="sim", name="anahtar 1", client=client, limiter=limiter,
+                         breaker=bot.CircuitBreaker("Gemini sim"))
+
+async def run_load(max_wait: float, args) -> dict:
+    """Dalgalı yükü koş: sağlayıcı başına cevap sayısı"""
+    bot.RATE_LIMIT_MAX_WAIT = max_wait
+    bot.gemini_keys = [make_key(args.rpm, args.minute, args.latency)]
+    bot.providers = [
+        bot.GeminiProvider("gemini"),
+        bot.StubProvider("stub", latency=args.latency, label="Yedek"),
+    ]
+    bot.llm_scheduler = bot.LLMScheduler(1000)
+
+    async def turn(chat_id: int):
+        session = bot.MunazaraSession(chat_id=chat_id, user_position="Deist", bot_position="Ateist", topic="Felsefe")
+        _, model = await bot.get_ai_response(session, f"Sohbet {chat_id} iddiası")
+        return model
+
+    tasks = []
+    for wave in range(args.waves):
+        for i in range(args.burst):
+            tasks.append(asyncio.create_task(turn(wave * args.burst + i)))
+        await asyncio.sleep(args.gap)
+    models = await asyncio.gather(*tasks)
+
+    counts: dict = {}
+    for model in models:
+        counts[model] = counts.get(model, 0) + 1
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--waits", default="0,1,3", help="denenecek RATE_LIMIT_MAX_WAIT değerleri (saniye)")
+    parser.add_argument("--rpm", type=float, default=4, help="dakikalık limit (GEMINI_RPM)")
+    parser.add_argument("--minute", type=float, default=4.0, help="bir dakikanın simülasyondaki süresi (saniye)")
+    parser.add_argument("--burst", type=int, default=6, help="dalga başına tur")
+    parser.add_argument("--waves", type=int, default=5)
+    parser.add_argument("--gap", type=float, default=3.0, help="dalgalar arası süre (saniye)")
+    parser.add_argument("--latency", type=float, default=0.3, help="sağlayıcı gecikmesi (saniye)")
+    args = parser.parse_args()
+
+    logging.getLogger("bot").setLevel(logging.CRITICAL)
+    bot.HEDGE_ENABLED = False  # sadece limit beklemesinin etkisi ölçülsün
+
+    total = args.burst * args.waves
+    print(f"{total} tur ({args.waves} dalga x {args.burst}, {args.gap:g}s arayla), "
+          f"limit {args.rpm:g} istek / {args.minute:g}s")
+    for max_wait in (float(w) for w in args.waits.split(",") if w):
+        started = time.perf_counter()
+        counts = asyncio.run(run_load(max_wait, args))
+        elapsed = time.perf_counter() - started
+        gemini = counts.get("Gemini", 0)
+        rest = ", ".join(f"{m}: {n}" for m, n in sorted(counts.items()) if m != "Gemini")
+        print(f"  bekleme {max_wait:4.1f}s  Gemini %{100 * gemini / total:3.0f} ({gemini}/{total})  {rest}  [{elapsed:.1f}s]")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 """
 Münazara GPT v2 - Grup Münazara Botu
-- Yeni google-genai SDK
-- Fallback: Gemini → OpenRouter DeepSeek
+- Yeni google-genai SDK (async istemci, event loop bloklanmaz)
+- Fallback: Gemini → OpenRouter DeepSeek (sağlayıcı zinciri LLM_PROVIDERS ile ayarlanır)
 - Grup desteği (@mention ile çalışır)
 - Instructions v6.1 akışı
 - Nöbet Devri Bildirimi (JobQueue ile günlük 08:00)
@@ -15,22 +15,46 @@ import os
 import logging
 import asyncio
 import re
+import json
+import random
+import hashlib
+import unicodedata
+import heapq
+import math
+from email.utils import parsedate_to_datetime
+from zoneinfo import ZoneInfo
+import importlib.util
 from datetime import datetime, timedelta, time as dt_time
-from typing import Optional, Tuple, Dict, Any, List
+from typing import Optional, Tuple, Dict, Any, List, Callable, Awaitable, AsyncIterator
+from collections import deque, OrderedDict
 from dataclasses import dataclass, field
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # Telegram
-from telegram import Update, Bot
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram import Update, Bot, Message
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, BaseUpdateProcessor
 from telegram.constants import ChatType
 
 # Yeni Google GenAI SDK
 from google import genai
 from google.genai import types
 
-# OpenRouter (OpenAI uyumlu)
-from openai import OpenAI
+# OpenRouter (OpenAI uyumlu, async)
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError
+
+# openai>=3 httpx2, eski sürümler httpx kullanır
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+# google-genai her zaman düz httpx kullanır (aiohttp kuruluysa onu da); bağlantı hatalarını tanımak için
+import httpx as genai_httpx
+try:
+    from aiohttp import ClientConnectionError as AiohttpConnectionError
+except ImportError:
+    AiohttpConnectionError = None
 
 load_dotenv()
 
@@ -47,8 +71,126 @@ logger = logging.getLogger(__name__)
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Birden fazla anahtar/proje: virgülle ayrılmış liste (yoksa GEMINI_API_KEY)
+GEMINI_API_KEYS = os.getenv("GEMINI_API_KEYS") or GEMINI_API_KEY or ""
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
+def env_int(name: str, default: int) -> int:
+    """Ortam değişkenini int olarak oku"""
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"{name} geçersiz, varsayılan kullanılıyor: {default}")
+        return default
+
+def env_float(name: str, default: float) -> float:
+    """Ortam değişkenini float olarak oku"""
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"{name} geçersiz, varsayılan kullanılıyor: {default}")
+        return default
+
+# OpenRouter HTTP bağlantı havuzu (tek paylaşımlı keep-alive istemci)
+OPENROUTER_TIMEOUT = env_float("OPENROUTER_TIMEOUT", 30.0)
+OPENROUTER_CONNECT_TIMEOUT = env_float("OPENROUTER_CONNECT_TIMEOUT", 5.0)
+OPENROUTER_MAX_CONNECTIONS = env_int("OPENROUTER_MAX_CONNECTIONS", 20)
+OPENROUTER_MAX_KEEPALIVE = env_int("OPENROUTER_MAX_KEEPALIVE", 10)
+OPENROUTER_KEEPALIVE_EXPIRY = env_float("OPENROUTER_KEEPALIVE_EXPIRY", 60.0)
+
+# LLM sağlayıcı zinciri (sıralı); LLM_CONFIG_FILE verilirse JSON'dan okunur
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "gemini,openrouter")
+LLM_CONFIG_FILE = os.getenv("LLM_CONFIG_FILE", "")
+
+# Hedge: birincil sağlayıcı geç kalırsa yedeği paralel başlat
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") == "1"
+HEDGE_DELAY = os.getenv("HEDGE_DELAY", "p90")  # saniye veya "p90" gibi yüzdelik
+HEDGE_DELAY_DEFAULT = env_float("HEDGE_DELAY_DEFAULT", 4.0)  # yeterli ölçüm yokken
+HEDGE_MAX_PARALLEL = env_int("HEDGE_MAX_PARALLEL", 2)
+HEDGE_CANCEL_LOSER = os.getenv("HEDGE_CANCEL_LOSER", "1") == "1"
+
+# Gecikme bütçeleri (saniye): zincirdeki tüm denemeler bu süreyi paylaşır
+TURN_BUDGET = env_float("TURN_BUDGET", 25.0)  # tartışma turu
+RESEARCH_BUDGET = env_float("RESEARCH_BUDGET", 40.0)  # do_research
+TOPICS_BUDGET = env_float("TOPICS_BUDGET", 30.0)  # generate_new_topics
+
+# LLM zamanlayıcı: aynı anda en fazla bu kadar LLM işi, sohbetler arası adil sıra
+LLM_CONCURRENCY = env_int("LLM_CONCURRENCY", 4)
+LLM_WEIGHT_INTERACTIVE = env_float("LLM_WEIGHT_INTERACTIVE", 4.0)  # tartışma turları
+LLM_WEIGHT_BACKGROUND = env_float("LLM_WEIGHT_BACKGROUND", 1.0)  # araştırma, konu üretimi
+
+# Prompt token bütçesi: geçmiş, sistem promptu + mesajla birlikte bu bütçeye sığdırılır
+# (sağlayıcı başına <TİP>_PROMPT_TOKENS ile değiştirilebilir)
+CHARS_PER_TOKEN = env_float("CHARS_PER_TOKEN", 3.5)  # yerel token tahmini için (Türkçe ~3.5)
+
+# Önek tekrarı ölçümü: sağlayıcı önek önbelleğinin yerel taklidi (/durum'da gösterilir)
+PREFIX_METER_TTL = env_float("PREFIX_METER_TTL", 300.0)  # saniye; sağlayıcı önbelleğinin tipik ömrü
+PREFIX_METER_SIZE = env_int("PREFIX_METER_SIZE", 5000)  # en fazla hatırlanan önek (LRU)
+
+# Uzun tartışmalar: eski turlar arka planda özetlenir, promptta ham hali yerine özet gider
+SUMMARY_KEEP_MESSAGES = env_int("SUMMARY_KEEP_MESSAGES", 10)  # son N mesaj her zaman ham gönderilir
+SUMMARY_BATCH_MESSAGES = env_int("SUMMARY_BATCH_MESSAGES", 6)  # bu kadar eski mesaj birikince özetle (0 = kapalı)
+SUMMARY_MAX_TOKENS = env_int("SUMMARY_MAX_TOKENS", 500)
+SUMMARY_BUDGET = env_float("SUMMARY_BUDGET", 30.0)
+
+# Gemini limitleri (token bucket) ve kapasite için en fazla bekleme
+GEMINI_RPM = env_float("GEMINI_RPM", 4)
+GEMINI_RPD = env_float("GEMINI_RPD", 240)
+RATE_LIMIT_MAX_WAIT = env_float("RATE_LIMIT_MAX_WAIT", 3.0)  # saniye; aşarsa yedeğe geç
+
+# 429 / geçici hata sonrası bekleme
+BACKOFF_BASE = env_float("BACKOFF_BASE", 5.0)  # saniye, her ardışık 429'da ikiye katlanır
+BACKOFF_MAX = env_float("BACKOFF_MAX", 300.0)
+TRANSIENT_RETRY_DELAY = env_float("TRANSIENT_RETRY_DELAY", 0.5)  # 5xx sonrası tek hızlı tekrar
+GEMINI_QUOTA_TZ = os.getenv("GEMINI_QUOTA_TZ", "America/Los_Angeles")  # günlük kota bu saat diliminde gece yarısı sıfırlanır
+
+# Gemini açık önbellek (cached content): sabit prompt öneki anahtar başına bir kez yüklenir
+# (depolama saatlik ücretlidir; önek modelin en küçük önbellek boyutunun altındaysa normal istek kullanılır)
+GEMINI_CACHED_PREFIX = os.getenv("GEMINI_CACHED_PREFIX", "0") == "1"
+GEMINI_CACHE_TTL = env_float("GEMINI_CACHE_TTL", 3600.0)  # saniye
+
+# Limit sayaçlarının kalıcı kaydı (restart sonrası kota takibi sürsün)
+RATE_STATE_FILE = os.getenv("RATE_STATE_FILE", "rate_state.json")
+RATE_STATE_SAVE_INTERVAL = env_float("RATE_STATE_SAVE_INTERVAL", 30.0)  # saniye
+
+# Araştırma / konu üretimi cevap önbelleği (diskte, restart sonrası sürer)
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "response_cache.json")
+RESPONSE_CACHE_TTL = env_float("RESPONSE_CACHE_TTL", 7 * 24 * 3600.0)  # saniye
+RESPONSE_CACHE_SIZE = env_int("RESPONSE_CACHE_SIZE", 500)  # en fazla kayıt (LRU)
+
+# Konu kütüphanesi: sık pozisyon çiftleri için hazır konular (küratörlü + öğrenilen)
+TOPIC_LIBRARY_FILE = os.getenv("TOPIC_LIBRARY_FILE", "topic_library.json")
+TOPIC_LIBRARY_LEARNED_FILE = os.getenv("TOPIC_LIBRARY_LEARNED_FILE", "topic_library_learned.json")
+TOPIC_LIBRARY_REFRESH_AGE = env_float("TOPIC_LIBRARY_REFRESH_AGE", 24 * 3600.0)  # bu yaştan eski kayıt arka planda yenilenir
+
+# Spekülatif araştırma: pozisyonlar belli olunca (setup 2. soru) konuyu beklemeden başla
+SPECULATIVE_RESEARCH = os.getenv("SPECULATIVE_RESEARCH", "1") == "1"
+SPECULATIVE_MIN_HEADROOM = env_float("SPECULATIVE_MIN_HEADROOM", 0.5)  # birincil sağlayıcıda en az bu oranda boş kapasite
+
+# İddia defteri: her turda yeni mesaja en yakın eski iddialar (BM25) prompta eklenir
+CLAIM_RECALL_COUNT = env_int("CLAIM_RECALL_COUNT", 3)  # 0 = kapalı
+CLAIM_MIN_TERMS = env_int("CLAIM_MIN_TERMS", 2)  # en az bu kadar ortak terim (kök) olmalı
+
+# Devre kesici: hata/yavaşlık oranı eşiği aşınca sağlayıcı geçici olarak atlanır
+BREAKER_WINDOW = env_int("BREAKER_WINDOW", 20)  # son N çağrı
+BREAKER_MIN_CALLS = env_int("BREAKER_MIN_CALLS", 5)
+BREAKER_ERROR_RATE = env_float("BREAKER_ERROR_RATE", 0.5)
+BREAKER_SLOW_CALL = env_float("BREAKER_SLOW_CALL", 15.0)  # saniye
+BREAKER_SLOW_RATE = env_float("BREAKER_SLOW_RATE", 0.8)
+BREAKER_OPEN_SECONDS = env_float("BREAKER_OPEN_SECONDS", 30.0)
+
+# Akış (streaming) modu: ilk token'larda mesaj at, sonra kademeli düzenle
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "1") == "1"
+STREAM_EDIT_INTERVAL = env_float("STREAM_EDIT_INTERVAL", 1.5)  # Telegram edit limiti için
+
+# Eşzamanlı işlenen en fazla güncelleme (farklı sohbetler paralel, aynı sohbet sıralı)
+UPDATE_CONCURRENCY = env_int("UPDATE_CONCURRENCY", 16)
+
+# Aynı sohbette kısa aralıklarla gelen mesajları tek tura birleştir (0 = kapalı)
+DEBOUNCE_WINDOW = env_float("DEBOUNCE_WINDOW", 0.0)  # son mesajdan sonra bekleme (saniye); her tura eklenir
+DEBOUNCE_MAX_WAIT = env_float("DEBOUNCE_MAX_WAIT", 6.0)  # ilk mesajdan itibaren en fazla bekleme
+DEBOUNCE_MAX_MESSAGES = env_int("DEBOUNCE_MAX_MESSAGES", 5)
+
 # Bot username (runtime'da alınacak)
 BOT_USERNAME = None
 
@@ -59,6 +201,97 @@ BOT_USERNAME = None
 # {chat_id: {"list": [(tarih, isim), ...], "message_id": pinned_msg_id}}
 nobet_data: Dict[int, Dict[str, Any]] = {}
 
+# ============================================
+# İDDİA DEFTERİ (Tutarsızlık tespiti için)
+# ============================================
+
+# Anlam taşımayan sık kelimeler (normalize edilmiş hali)
+CLAIM_STOPWORDS = {
+    "ve", "veya", "ile", "ama", "fakat", "ancak", "cunku", "icin", "gibi", "kadar", "daha", "cok",
+    "bir", "bu", "su", "o", "da", "de", "ki", "mi", "mu", "ne", "ya", "hem", "ise", "diye",
+    "ben", "sen", "biz", "siz", "onlar", "bana", "sana", "beni", "seni", "benim", "senin",
+    "var", "yok", "degil", "olan", "olarak", "olur", "oldu", "her", "hic", "en", "sadece",
+}
+CLAIM_STEM_LENGTH = 5  # Türkçe eklemeli; ilk 5 harf kök için iyi bir yaklaşım
+
+def claim_terms(text: str) -> List[str]:
+    """İddia metnini terimlere ayır: kesme ekini at, normalize et, durak kelime at, kaba kök (ilk 5 harf)"""
+    text = re.sub(r"['’]\w+", "", text)
+    return [
+        word[:CLAIM_STEM_LENGTH]
+        for word in normalize_position(text).split()
+        if len(word) > 1 and word not in CLAIM_STOPWORDS
+    ]
+
+@dataclass
+class Claim:
+    """Kullanıcının tek bir iddiası"""
+    author: str
+    text: str
+    turn: int  # kaçıncı kullanıcı turunda söylendi
+    history_index: int  # chat_history'deki yeri
+
+class ClaimLedger:
+    """
+    Oturum başına kullanıcı iddiaları ve BM25 ters indeksi.
+    Sorgu sadece sorgu terimlerinin geçtiği iddiaları puanlar; yüzlerce turda bile milisaniyenin altında.
+    """
+    K1 = 1.2
+    B = 0.75
+    
+    def __init__(self):
+        self.claims: List[Claim] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, Dict[int, int]] = {}  # terim -> {iddia no: frekans}
+        self.total_length = 0
+    
+    def add(self, author: str, text: str, turn: int, history_index: int):
+        terms = claim_terms(text)
+        if len(terms) < 3:
+            return  # "evet", "konu 2" gibi kısa mesajlar iddia değil
+        
+        claim_id = len(self.claims)
+        self.claims.append(Claim(author, text, turn, history_index))
+        self.lengths.append(len(terms))
+        self.total_length += len(terms)
+        for term in terms:
+            postings = self.postings.setdefault(term, {})
+            postings[claim_id] = postings.get(claim_id, 0) + 1
+    
+    def search(self, text: str, limit: int, before_index: int, min_terms: int) -> List[Claim]:
+        """Metne en yakın eski iddialar (chat_history'de before_index'ten önce söylenenler)"""
+        if not self.claims or limit <= 0:
+            return []
+        
+        count = len(self.claims)
+        lengths = self.lengths
+        k1 = self.K1
+        base = k1 * (1 - self.B)
+        per_length = k1 * self.B * count / self.total_length
+        scores: Dict[int, float] = {}
+        matches: Dict[int, int] = {}
+        for term in set(claim_terms(text)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)) * (k1 + 1)
+            for claim_id, tf in postings.items():
+                score = idf * tf / (tf + base + per_length * lengths[claim_id])
+                if claim_id in scores:
+                    scores[claim_id] += score
+                    matches[claim_id] += 1
+                else:
+                    scores[claim_id] = score
+                    matches[claim_id] = 1
+        
+        ranked = heapq.nlargest(
+            limit,
+            (item for item in scores.items()
+             if matches[item[0]] >= min_terms and self.claims[item[0]].history_index < before_index),
+            key=lambda item: item[1]
+        )
+        return [self.claims[claim_id] for claim_id, _ in ranked]
+
 # ============================================
 # MÜNAZARA OTURUMU
 # ============================================
@@ -67,6 +300,7 @@ nobet_data: Dict[int, Dict[str, Any]] = {}
 class MunazaraSession:
     """Bir grup için münazara oturumu"""
     state: str = "IDLE"  # IDLE, SETUP, DISCUSSING
+    chat_id: int = 0  # LLM zamanlayıcısında adil sıra için
     setup_step: int = 0
     
     # Ayarlar
@@ -89,9 +323,34 @@ class MunazaraSession:
     # Web araştırma sonucu (kullanıcıya gösterilmez)
     research_notes: str = ""
     
+    # Eski turların özeti; chat_history[:summarized_upto] bu özete katlandı
+    summary: str = ""
+    summarized_upto: int = 0
+    summary_task: Optional[asyncio.Task] = field(default=None, repr=False)
+    
+    # Kullanıcı iddiaları (tutarsızlık kanıtı için geri çağrılır)
+    claims: ClaimLedger = field(default_factory=ClaimLedger, repr=False)
+    user_turns: int = 0
+    
+    # Sistem promptu önbelleği: prompta giren alanlar değişince settings_version artar
+    settings_version: int = 0
+    prompt_version: int = -1
+    prompt_cache: str = field(default="", repr=False)
+    
+    def bump_settings(self):
+        """Prompta giren bir alan değişti - önbellekteki prompt geçersiz"""
+        self.settings_version += 1
+    
     # Saldırı konuları listesi
     attack_topics: list = field(default_factory=list)
     completed_topics: list = field(default_factory=list)
+    
+    # Setup sonrası arka planda süren araştırma
+    research_task: Optional[asyncio.Task] = field(default=None, repr=False)
+    # Setup sırasında konu beklenmeden başlatılan taslak araştırma
+    draft_research: Optional[asyncio.Task] = field(default=None, repr=False)
+    # Son konuya gelince önceden üretilen sıradaki konu listesi
+    next_topics: Optional[asyncio.Task] = field(default=None, repr=False)
 
 # Grup oturumları: {chat_id: MunazaraSession}
 sessions: Dict[int, MunazaraSession] = {}
@@ -176,29 +435,35 @@ Din / Felsefe / Tasavvuf / Siyaset / Ekonomi / Bilim / Diğer
 _Konuyu yazın veya spesifik bir tez belirtin..._"""
 ]
 
+# 5. sorudaki genel konu seçenekleri (spesifik tez değil)
+SETUP_TOPIC_CATEGORIES = ["Din", "Felsefe", "Tasavvuf", "Siyaset", "Ekonomi", "Bilim", "Diğer"]
+
 # ============================================
 # SİSTEM PROMPTU (Instructions v6.1)
 # ============================================
 
-def get_system_prompt(session: MunazaraSession) -> str:
-    """Oturuma göre sistem promptu oluştur"""
-    
-    return f"""# 🔥 MÜNAZARA GPT - RAKİP MODU
+# Sertlik ve stil kuralları: sadece seçilen metin prompta girer
+SEVERITY_RULES = {
+    "⚪Çok Hafif": "⚪Çok Hafif: İlkokul-ortaokul seviyesi. Genel kabul gören doğru bilgilere 'Haklısın, bu doğru.' de ve geç. Örneğin 'üçgenin iç açıları toplamı 180 derece' gibi temel bilgilere itiraz etme. Sadece açıkça yanlış veya mantıksız şeylere karşı çık. Derin bilimsel/felsefi detaylara girme (uzay-zaman eğriliği, kuantum mekaniği gibi). Nazik ve öğretici ol. AMA tutarsızlık tespitini yine de yap - nazikçe 'Bir dakika, az önce şöyle demiştin ama şimdi farklı söylüyorsun, hangisi doğru?' şeklinde sor.",
+    "🟢Hafif": "🟢Hafif: Nazik dil, soru ağırlıklı",
+    "🟡Orta": "🟡Orta: Direkt dil, iddia+soru dengeli",
+    "🔴Sert": "🔴Sert: Keskin dil, kaçışa sıfır tolerans",
+    "⚫Vahşi": "⚫Vahşi: Acımasız, reductio ad absurdum, merhamet yok",
+}
+
+STYLE_RULES = {
+    "Sokratik": "Sokratik: Karşı iddia YOK. Sadece tek soru ama tuzak kuran.",
+    "Diyalektik": "Diyalektik: İddia + soru karışık.",
+}
+
+# Sabit önek: tüm oturumlarda bayt bayt aynı, böylece sağlayıcı önbelleği
+# (Gemini/DeepSeek önek önbelleği, GEMINI_CACHED_PREFIX) oturumlar arasında kullanılır.
+# Oturuma özel hiçbir şey buraya yazılmamalı; onlar SESSION_PROMPT_TEMPLATE'e.
+SYSTEM_PROMPT_PREFIX = """# 🔥 MÜNAZARA GPT - RAKİP MODU
 
 ## KİMLİĞİN
 Sen yardımcı değil, RAKİPSİN. Kullanıcının iddiasını çürütmek için kendi rolünün inançlarını SİLAH olarak kullanırsın.
-
-## ROLLER
-- KULLANICI: {session.user_position} (savunuyor)
-- SEN: {session.bot_position} (saldırıyor)
-
-## AYARLAR
-- Sertlik: {session.severity}
-- Stil: {session.style}
-- Konu: {session.topic}
-
-## ARAŞTIRMA NOTLARIN (KULLANICIYA GÖSTERME)
-{session.research_notes}
+Rolün, ayarların ve araştırma notların en alttaki OTURUM bölümünde.
 
 ## SALDIRI FORMATI (HER TURDA)
 1. Mini anlama kontrolü (1 cümle): "Şunu diyorsun: [özetle]. Doğru mu?"
@@ -240,16 +505,6 @@ Ana görevin kullanıcının KENDİ İÇİNDE tutarlı olup olmadığını kontr
 
 **Amaç:** Kullanıcının kendini geliştirmesi, kendi içinde tutarlı olması için yardım et.
 
-## SERTLİK: {session.severity}
-{"⚪Çok Hafif: İlkokul-ortaokul seviyesi. Genel kabul gören doğru bilgilere 'Haklısın, bu doğru.' de ve geç. Örneğin 'üçgenin iç açıları toplamı 180 derece' gibi temel bilgilere itiraz etme. Sadece açıkça yanlış veya mantıksız şeylere karşı çık. Derin bilimsel/felsefi detaylara girme (uzay-zaman eğriliği, kuantum mekaniği gibi). Nazik ve öğretici ol. AMA tutarsızlık tespitini yine de yap - nazikçe 'Bir dakika, az önce şöyle demiştin ama şimdi farklı söylüyorsun, hangisi doğru?' şeklinde sor." if "Çok Hafif" in session.severity else ""}
-{"🟢Hafif: Nazik dil, soru ağırlıklı" if "Hafif" in session.severity and "Çok Hafif" not in session.severity else ""}
-{"🟡Orta: Direkt dil, iddia+soru dengeli" if "Orta" in session.severity else ""}
-{"🔴Sert: Keskin dil, kaçışa sıfır tolerans" if "Sert" in session.severity else ""}
-{"⚫Vahşi: Acımasız, reductio ad absurdum, merhamet yok" if "Vahşi" in session.severity else ""}
-
-## STİL: {session.style}
-{"Sokratik: Karşı iddia YOK. Sadece tek soru ama tuzak kuran." if "Sokratik" in session.style else "Diyalektik: İddia + soru karışık."}
-
 ## TUR SONU
 Her itirazın altına şunu ekle:
 "1️⃣ Pes ettim | 2️⃣ Benim yerime cevap ver | 3️⃣ Geç"
@@ -261,118 +516,927 @@ Her itirazın altına şunu ekle:
 - Max 150 kelime/mesaj
 - Günlük Türkçe
 - Bir cümlede tek fikir
-- Türkçe karakterler: ğüşıöçĞÜŞİÖÇ"""
+- Türkçe karakterler: ğüşıöçĞÜŞİÖÇ
+
+"""
+
+# Oturuma özel bölüm: önekten sonra, mesaj geçmişinden önce
+SESSION_PROMPT_TEMPLATE = """# OTURUM
+
+## ROLLER
+- KULLANICI: {user_position} (savunuyor)
+- SEN: {bot_position} (saldırıyor)
+
+## AYARLAR
+- Sertlik: {severity}
+- Stil: {style}
+- Konu: {topic}
+
+## SERTLİK: {severity}
+{severity_rule}
+
+## STİL: {style}
+{style_rule}
+
+## ARAŞTIRMA NOTLARIN (KULLANICIYA GÖSTERME)
+{research_notes}
+{summary_section}"""
+
+def get_system_prompt(session: MunazaraSession) -> str:
+    """Sabit önek + oturum bölümü (ayar sürümü değişmedikçe önbellekten)"""
+    if session.prompt_cache and session.prompt_version == session.settings_version:
+        return session.prompt_cache
+    
+    # Mesaj geçmişinden önce kalan turlar özet olarak
+    summary_section = ""
+    if session.summary:
+        summary_section = (
+            "\n## ÖNCEKİ TURLARIN ÖZETİ (KULLANICIYA GÖSTERME)\n"
+            "Aşağıdaki mesaj geçmişinden önceki konuşma. Tutarsızlık tespitinde bunu da kullan.\n"
+            f"{session.summary}\n"
+        )
+    
+    session.prompt_cache = SYSTEM_PROMPT_PREFIX + SESSION_PROMPT_TEMPLATE.format(
+        user_position=session.user_position,
+        bot_position=session.bot_position,
+        severity=session.severity,
+        style=session.style,
+        topic=session.topic,
+        research_notes=session.research_notes,
+        summary_section=summary_section,
+        severity_rule=SEVERITY_RULES.get(session.severity, ""),
+        style_rule=STYLE_RULES.get(session.style, STYLE_RULES["Diyalektik"])
+    )
+    session.prompt_version = session.settings_version
+    return session.prompt_cache
 
 # ============================================
 # RATE LIMIT TRACKER
 # ============================================
 
+class TokenBucket:
+    """Token bucket (monotonic saat): rate token/sn dolar, en fazla capacity birikir"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+    
+    def wait_time(self) -> float:
+        """Bir token için beklenecek süre (saniye)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+    
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+    
+    def refund(self):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + 1)
+    
+    def to_dict(self) -> Dict[str, float]:
+        """Kalıcı kayıt için (duvar saati ile)"""
+        return {"tokens": self.available(), "saved_at": time.time()}
+    
+    def load_dict(self, data: Dict[str, float]):
+        """Kayıttan yükle; aradan geçen süre kadar dolmuş say"""
+        elapsed = max(0.0, time.time() - data.get("saved_at", time.time()))
+        self.tokens = min(self.capacity, data.get("tokens", self.capacity))
+        self.updated = time.monotonic() - elapsed
+        self._refill()
+
 class RateLimitTracker:
-    def __init__(self):
-        self.requests_this_minute = 0
+    """
+    Gemini limitleri: dakikalık ve günlük token bucket + geçici blok.
+    Bekleme GeminiProvider.acquire'da (anahtar havuzu üzerinden) yapılır.
+    """
+    
+    def __init__(self, rpm: float, rpd: float):
+        self.minute_bucket = TokenBucket(rate=rpm / 60, capacity=rpm)
+        self.day_bucket = TokenBucket(rate=rpd / 86400, capacity=rpd)
+        self.blocked_until = 0.0  # monotonic
+        self.strikes = 0  # ardışık rate limit sayısı (backoff için)
         self.requests_today = 0
-        self.minute_reset = datetime.now()
-        self.day_reset = datetime.now()
-        self.blocked_until: Optional[datetime] = None
+        self.day = datetime.now().date()
+    
+    def wait_time(self) -> float:
+        """Bir istek için beklenecek süre (0 = hemen)"""
+        blocked = max(0.0, self.blocked_until - time.monotonic())
+        return max(blocked, self.minute_bucket.wait_time(), self.day_bucket.wait_time())
     
     def can_use_gemini(self) -> bool:
-        now = datetime.now()
+        return self.wait_time() == 0
+    
+    def headroom(self) -> float:
+        """Kalan kapasite oranı (0-1): dakikalık ve günlük bucket'ın darı"""
+        return min(self.minute_bucket.available() / self.minute_bucket.capacity,
+                   self.day_bucket.available() / self.day_bucket.capacity)
+    
+    def take(self):
+        """Bir istek hakkı düş (önce can_use_gemini ile kontrol edilmeli)"""
+        self.minute_bucket.take()
+        self.day_bucket.take()
+    
+    def refund(self):
+        """Kullanılmayan hakkı geri ver (istek hiç gönderilmediyse)"""
+        self.minute_bucket.refund()
+        self.day_bucket.refund()
+    
+    def record_request(self):
+        today = datetime.now().date()
+        if today != self.day:
+            self.day = today
+            self.requests_today = 0
+        self.requests_today += 1
+        self.strikes = 0
+    
+    def block(self, seconds: float = 60):
+        self.blocked_until = time.monotonic() + seconds
+    
+    def penalize(self, kind: str, retry_after: Optional[float]) -> float:
+        """
+        Rate limit / kota hatası sonrası blokla.
+        Günlük kotada bir sonraki sıfırlamaya kadar (retryDelay burada yanıltıcı),
+        aksi halde sunucunun önerdiği süre ya da jitter'lı üstel backoff. Döndürür: blok süresi
+        """
+        if kind == ERROR_QUOTA:
+            seconds = seconds_until_quota_reset()
+        elif retry_after is not None:
+            seconds = retry_after
+        else:
+            seconds = backoff_delay(self.strikes)
         
-        if self.blocked_until and now < self.blocked_until:
-            return False
+        self.strikes += 1
+        self.block(seconds)
+        return seconds
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Kalıcı kayıt için durum (monotonic süreler duvar saatine çevrilir)"""
+        return {
+            "minute": self.minute_bucket.to_dict(),
+            "day": self.day_bucket.to_dict(),
+            "blocked_until": time.time() + max(0.0, self.blocked_until - time.monotonic()),
+            "requests_today": self.requests_today,
+            "date": self.day.isoformat()
+        }
+    
+    def load_dict(self, data: Dict[str, Any]):
+        """Kayıttan yükle ve şimdiki zamanla uzlaştır"""
+        self.minute_bucket.load_dict(data.get("minute", {}))
+        self.day_bucket.load_dict(data.get("day", {}))
+        self.blocked_until = time.monotonic() + max(0.0, data.get("blocked_until", 0.0) - time.time())
         
-        if now - self.minute_reset > timedelta(minutes=1):
-            self.requests_this_minute = 0
-            self.minute_reset = now
+        # Gün değiştiyse günlük sayaç sıfırdan başlar
+        if data.get("date") == datetime.now().date().isoformat():
+            self.requests_today = data.get("requests_today", 0)
+    
+    def describe(self) -> str:
+        """Log için durum özeti"""
+        return (f"dakika: {self.minute_bucket.available():.1f}, gün: {self.day_bucket.available():.0f}, "
+                f"blok: {max(0.0, self.blocked_until - time.monotonic()):.0f}s")
+
+# ============================================
+# HATA SINIFLANDIRMA
+# ============================================
+
+ERROR_RATE_LIMIT = "rate_limit"  # 429, kısa süreli
+ERROR_QUOTA = "quota"  # günlük kota bitti
+ERROR_TRANSIENT = "transient"  # 5xx, bağlantı hatası
+ERROR_PERMANENT = "permanent"  # 4xx, hatalı istek/anahtar
+
+# Bağlantı/zaman aşımı hataları: OpenRouter (openai → httpx2 veya httpx), Gemini (httpx, opsiyonel aiohttp)
+TRANSPORT_ERRORS = tuple(t for t in (
+    APIConnectionError, httpx.TransportError, genai_httpx.TransportError, AiohttpConnectionError,
+    ConnectionError, asyncio.TimeoutError
+) if t is not None)
+
+RETRY_DELAY_PATTERN = re.compile(r"retry_?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE)
+RETRY_IN_PATTERN = re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+def backoff_delay(strikes: int) -> float:
+    """Jitter'lı üstel bekleme: yarısı sabit, yarısı rastgele"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** strikes))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def seconds_until_quota_reset() -> float:
+    """Günlük kotanın sıfırlanmasına kalan süre (kota saat diliminde gece yarısı)"""
+    try:
+        tz = ZoneInfo(GEMINI_QUOTA_TZ)
+    except Exception:
+        logger.warning(f"Saat dilimi bulunamadı: {GEMINI_QUOTA_TZ}, UTC kullanılıyor")
+        tz = ZoneInfo("UTC")
+    
+    now = datetime.now(tz)
+    reset = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (reset - now).total_seconds()
+
+def parse_retry_after(e: Exception) -> Optional[float]:
+    """Retry-After başlığı veya Gemini RetryInfo.retryDelay ipucunu oku (saniye)"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                try:
+                    return max(0.0, (parsedate_to_datetime(value) - datetime.now(ZoneInfo("UTC"))).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+    
+    text = f"{e} {getattr(e, 'details', '')}"
+    match = RETRY_DELAY_PATTERN.search(text) or RETRY_IN_PATTERN.search(text)
+    if match:
+        return float(match.group(1))
+    return None
+
+def classify_error(e: Exception) -> Tuple[str, Optional[float]]:
+    """Hata türünü belirle: (tür, sunucunun önerdiği bekleme veya None)"""
+    if isinstance(e, TRANSPORT_ERRORS):
+        return ERROR_TRANSIENT, None
+    
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    text = f"{e} {getattr(e, 'details', '')}".lower()
+    
+    if status == 429 or "resource_exhausted" in text:
+        # Günlük kota ihlali (örn. GenerateRequestsPerDayPerProjectPerModel)
+        kind = ERROR_QUOTA if "perday" in text else ERROR_RATE_LIMIT
+        return kind, parse_retry_after(e)
+    
+    if isinstance(status, int):
+        if status >= 500:
+            return ERROR_TRANSIENT, parse_retry_after(e)
+        if status >= 400:
+            return ERROR_PERMANENT, None
+    
+    return ERROR_PERMANENT, None
+
+# ============================================
+# TOKEN TAHMİNİ VE GEÇMİŞ PENCERESİ
+# ============================================
+
+def estimate_tokens(text: str) -> int:
+    """Hızlı yerel token tahmini (tokenizer çağırmadan)"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def message_tokens(msg: dict) -> int:
+    """Geçmiş mesajının token tahmini; mesaj sözlüğünde önbelleklenir"""
+    tokens = msg.get("tokens")
+    if tokens is None:
+        tokens = msg["tokens"] = estimate_tokens(msg["content"]) + 4  # rol/ayraç payı
+    return tokens
+
+def select_history(chat_history: list, budget: int) -> Tuple[list, int]:
+    """Bütçeye sığan en yeni mesajları sırasıyla seç: (pencere, token)"""
+    used = 0
+    start = len(chat_history)
+    for i in range(len(chat_history) - 1, -1, -1):
+        cost = message_tokens(chat_history[i])
+        if used + cost > budget:
+            break
+        used += cost
+        start = i
+    return chat_history[start:], used
+
+class PrefixMeter:
+    """
+    Sağlayıcı önek önbelleğinin yerel taklidi.
+    İstek parçalara bölünür (sabit önek, oturum bölümü, her geçmiş mesajı, yeni
+    mesaj); baştan itibaren zincirlenen özet son PREFIX_METER_TTL içinde
+    görüldüyse o noktaya kadarki token'lar tekrar kullanılabilir önek sayılır.
+    """
+    
+    def __init__(self, ttl: float, size: int):
+        self.ttl = ttl
+        self.size = size
+        self.seen: OrderedDict = OrderedDict()  # zincir özeti -> son görülme (monotonic)
+        self.requests = 0
+        self.total_tokens = 0
+        self.reused_tokens = 0
+    
+    @staticmethod
+    def segments(system_prompt: Optional[str], chat_history: list, user_message: str) -> List[Tuple[str, int]]:
+        """İsteğin sırasıyla parçaları: (metin, token tahmini)"""
+        parts = []
+        if system_prompt:
+            if system_prompt.startswith(SYSTEM_PROMPT_PREFIX):
+                parts.append((SYSTEM_PROMPT_PREFIX, estimate_tokens(SYSTEM_PROMPT_PREFIX)))
+                system_prompt = system_prompt[len(SYSTEM_PROMPT_PREFIX):]
+            parts.append((system_prompt, estimate_tokens(system_prompt)))
+        for msg in chat_history:
+            parts.append((f"{msg['role']}:{msg['content']}", message_tokens(msg)))
+        parts.append((f"user:{user_message}", estimate_tokens(user_message)))
+        return parts
+    
+    def record(self, scope: str, system_prompt: Optional[str], chat_history: list, user_message: str) -> Tuple[int, int]:
+        """Gönderilen isteği kaydet: (tekrar kullanılabilir önek token'ı, toplam token)"""
+        now = time.monotonic()
+        digest = hashlib.sha256(scope.encode())
+        reused = total = 0
+        matching = True
+        for text, tokens in self.segments(system_prompt, chat_history, user_message):
+            digest.update(b"\0" + text.encode())
+            key = digest.hexdigest()
+            seen_at = self.seen.get(key)
+            if matching and seen_at is not None and now - seen_at <= self.ttl:
+                reused += tokens
+            else:
+                matching = False
+            self.seen[key] = now
+            self.seen.move_to_end(key)
+            total += tokens
         
-        if now - self.day_reset > timedelta(days=1):
-            self.requests_today = 0
-            self.day_reset = now
+        while len(self.seen) > self.size:
+            self.seen.popitem(last=False)
         
-        # Limitler: 5 RPM, 250 RPD
-        return self.requests_this_minute < 4 and self.requests_today < 240
-    
-    def record_request(self):
-        self.requests_this_minute += 1
-        self.requests_today += 1
+        self.requests += 1
+        self.total_tokens += total
+        self.reused_tokens += reused
+        return reused, total
     
-    def block(self, seconds: int = 60):
-        self.blocked_until = datetime.now() + timedelta(seconds=seconds)
+    def describe(self) -> str:
+        if not self.requests:
+            return "henüz istek yok"
+        ratio = self.reused_tokens / self.total_tokens * 100
+        return f"%{ratio:.0f} (~{self.reused_tokens}/{self.total_tokens} token, {self.requests} istek)"
+
+prefix_meter = PrefixMeter(PREFIX_METER_TTL, PREFIX_METER_SIZE)
+
+# ============================================
+# LLM SAĞLAYICI ARAYÜZÜ
+# ============================================
+
+async def peek_stream(chunks: AsyncIterator[str]) -> Optional[AsyncIterator[str]]:
+    """İlk boş olmayan parçayı bekle; akışı o parça dahil geri ver (boşsa None)"""
+    async for text in chunks:
+        if text:
+            return chain_stream(text, chunks)
+    return None
 
-rate_tracker = RateLimitTracker()
+async def chain_stream(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Önceden okunmuş ilk parçayı akışın başına ekle"""
+    yield first
+    async for text in rest:
+        yield text
+
+class CircuitBreaker:
+    """
+    Sağlayıcı başına devre kesici (CLOSED / OPEN / HALF_OPEN).
+    Son çağrıların hata veya yavaşlık oranı eşiği aşarsa açılır; açıkken
+    istekler anında reddedilir. Süre dolunca tek bir deneme isteği geçer.
+    """
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.outcomes: deque = deque(maxlen=BREAKER_WINDOW)  # (başarılı mı, süre)
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+    
+    def allow_request(self) -> bool:
+        """İstek geçebilir mi (HALF_OPEN'da sadece tek deneme)"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < BREAKER_OPEN_SECONDS:
+                return False
+            self.state = self.HALF_OPEN
+            logger.info(f"Devre yarı açık: {self.name} (deneme isteği)")
+        
+        if self.state == self.HALF_OPEN:
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+        
+        return True
+    
+    def record_success(self, latency: float):
+        if self.state == self.HALF_OPEN:
+            logger.info(f"Devre kapandı: {self.name} (deneme başarılı)")
+            self.state = self.CLOSED
+            self.outcomes.clear()
+            self.probe_in_flight = False
+        self.outcomes.append((True, latency))
+        self._evaluate()
+    
+    def record_failure(self, latency: float):
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = False
+            self._trip("deneme başarısız")
+            return
+        self.outcomes.append((False, latency))
+        self._evaluate()
+    
+    def release(self):
+        """Sonuçsuz biten istek (iptal) - deneme hakkını geri ver"""
+        self.probe_in_flight = False
+    
+    def _evaluate(self):
+        if self.state != self.CLOSED or len(self.outcomes) < BREAKER_MIN_CALLS:
+            return
+        
+        total = len(self.outcomes)
+        errors = sum(1 for ok, _ in self.outcomes if not ok)
+        slow = sum(1 for _, latency in self.outcomes if latency >= BREAKER_SLOW_CALL)
+        
+        if errors / total >= BREAKER_ERROR_RATE:
+            self._trip(f"hata oranı {errors}/{total}")
+        elif slow / total >= BREAKER_SLOW_RATE:
+            self._trip(f"yavaş çağrı oranı {slow}/{total}")
+    
+    def _trip(self, reason: str):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        logger.warning(f"Devre açıldı: {self.name} ({reason}), {BREAKER_OPEN_SECONDS:.0f}s atlanacak")
+    
+    def rejects(self) -> bool:
+        """allow_request şu an reddeder mi (durum değiştirmeden kontrol)"""
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at < BREAKER_OPEN_SECONDS
+        if self.state == self.HALF_OPEN:
+            return self.probe_in_flight
+        return False
+    
+    def badge(self) -> str:
+        """/durum için devre durumu etiketi"""
+        if self.state == self.OPEN:
+            return " [devre açık]"
+        if self.state == self.HALF_OPEN:
+            return " [devre yarı açık]"
+        return ""
+
+class LLMProvider:
+    """
+    Sağlayıcı arayüzü.
+    Alt sınıflar _generate ve _stream'i uygular; zaman aşımı, devre kesici ve
+    hata yakalama burada. acquire() bir "lease" döndürür (Gemini'de seçilen
+    anahtarı taşıyan GeminiLease); lease çağrıya ve sonuç kaydına aynen geçer.
+    """
+    TYPE = ""
+    LABEL = ""
+    DEFAULT_MODEL = ""
+    DEFAULT_MAX_TOKENS = 1024
+    DEFAULT_TIMEOUT = 30.0
+    DEFAULT_PROMPT_TOKENS = 6000
+    
+    def __init__(self, name: str, model: str = "", timeout: float = 0, max_tokens: int = 0, label: str = "",
+                 prompt_tokens: int = 0, **options):
+        self.name = name
+        self.label = label or self.LABEL or name
+        self.model = model or self.DEFAULT_MODEL
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.max_tokens = max_tokens or self.DEFAULT_MAX_TOKENS
+        self.prompt_tokens = prompt_tokens or self.DEFAULT_PROMPT_TOKENS
+        self.options = options
+        self.breaker = CircuitBreaker(self.label)
+        self.cooldown_until = 0.0  # 429 sonrası bekleme (monotonic)
+        self.strikes = 0
+    
+    def available(self) -> bool:
+        """Sağlayıcı yapılandırılmış mı"""
+        return True
+    
+    async def acquire(self, timeout: float) -> Optional[Any]:
+        """İstek hakkı al (devre kesici, rate limit); gerekirse timeout kadar bekle. None = hak yok"""
+        if time.monotonic() < self.cooldown_until:
+            logger.info(f"{self.label} atlandı (rate limit beklemesi)")
+            return None
+        if not self.breaker.allow_request():
+            logger.info(f"{self.label} atlandı (devre açık)")
+            return None
+        return self
+    
+    def breaker_for(self, lease: Any) -> CircuitBreaker:
+        """Sonucun kaydedileceği devre kesici"""
+        return self.breaker
+    
+    def has_headroom(self, min_ratio: float) -> bool:
+        """Ertelenebilir (spekülatif) iş için yeterli boş kapasite var mı"""
+        return time.monotonic() >= self.cooldown_until and not self.breaker.rejects()
+    
+    def status(self) -> str:
+        """/durum için kısa durum metni"""
+        return ("✅" if self.available() else "❌") + self.breaker.badge()
+    
+    def on_error(self, e: Exception, lease: Any, kind: str, retry_after: Optional[float]):
+        """Hata sonrası işlem: rate limit/kotada sağlayıcıyı beklet"""
+        if kind in (ERROR_RATE_LIMIT, ERROR_QUOTA):
+            delay = retry_after if retry_after is not None else backoff_delay(self.strikes)
+            self.strikes += 1
+            self.cooldown_until = time.monotonic() + delay
+            logger.warning(f"{self.label} rate limit ({kind}), {delay:.0f}s beklenecek: {e}")
+            return
+        
+        logger.error(f"{self.label} hatası ({kind}): {e}")
+    
+    def on_success(self, lease: Any):
+        """Başarılı çağrı sonrası işlem"""
+        self.strikes = 0
+    
+    def on_cancel(self, lease: Any):
+        """Cevap beklenirken iptal edilen çağrı sonrası işlem"""
+        pass
+    
+    def effective_timeout(self, timeout: Optional[float]) -> float:
+        """Sağlayıcı zaman aşımı ile kalan bütçenin küçüğü"""
+        return min(self.timeout, timeout) if timeout is not None else self.timeout
+    
+    async def _run(self, call: Callable[[Any], Awaitable[Any]], timeout: Optional[float], action: str) -> Tuple[Optional[Any], bool]:
+        """Hak al, çağrıyı süre sınırıyla çalıştır, sonucu devre kesiciye kaydet"""
+        if not self.available():
+            return None, False
+        
+        deadline = time.monotonic() + self.effective_timeout(timeout)
+        
+        # Geçici hatada (5xx, bağlantı) bütçe yetiyorsa bir kez daha dene
+        for attempt in range(2):
+            lease = await self.acquire(min(RATE_LIMIT_MAX_WAIT, deadline - time.monotonic()))
+            if lease is None:
+                return None, False
+            
+            breaker = self.breaker_for(lease)
+            remaining = deadline - time.monotonic()
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(call(lease), remaining)
+            except asyncio.CancelledError:
+                # Hedge kaybedeni ya da bütçe dolunca iptal: yeterince uzun sürdüyse
+                # asılmış sayılır (yoksa takılan sağlayıcının devresi hiç açılmaz)
+                elapsed = time.monotonic() - started
+                if elapsed >= min(BREAKER_SLOW_CALL, get_hedge_delay(self.label, action)) or time.monotonic() >= deadline:
+                    logger.info(f"{self.label} {action} {elapsed:.1f}s sonra iptal edildi, başarısız sayılıyor")
+                    breaker.record_failure(elapsed)
+                    record_latency(self.label, action, elapsed)
+                else:
+                    breaker.release()
+                self.on_cancel(lease)
+                raise
+            except asyncio.TimeoutError:
+                logger.warning(f"{self.label} {action} zaman aşımı ({remaining:.1f}s)")
+                breaker.record_failure(time.monotonic() - started)
+                return None, False
+            except Exception as e:
+                kind, retry_after = classify_error(e)
+                self.on_error(e, lease, kind, retry_after)
+                
+                if kind in (ERROR_RATE_LIMIT, ERROR_QUOTA):
+                    # Kapasite sorunu, sağlık sorunu değil - devre kesiciye yazma
+                    breaker.release()
+                    return None, False
+                
+                breaker.record_failure(time.monotonic() - started)
+                retry_delay = TRANSIENT_RETRY_DELAY * random.uniform(0.5, 1.5)
+                if kind == ERROR_TRANSIENT and attempt == 0 and deadline - time.monotonic() > retry_delay + 1:
+                    logger.info(f"{self.label} geçici hata, {retry_delay:.1f}s sonra tekrar deneniyor")
+                    await asyncio.sleep(retry_delay)
+                    continue
+                return None, False
+            
+            if not result:
+                logger.warning(f"{self.label} boş {action} döndürdü")
+                breaker.record_failure(time.monotonic() - started)
+                return None, False
+            
+            breaker.record_success(time.monotonic() - started)
+            self.on_success(lease)
+            return result, True
+        
+        return None, False
+    
+    async def generate(self, system_prompt: Optional[str], user_message: str, chat_history: list,
+                       temperature: float = 0.7, max_tokens: Optional[int] = None,
+                       timeout: Optional[float] = None) -> Tuple[Optional[str], bool]:
+        """Tek seferde cevap üret: (cevap, başarılı mı). timeout: kalan tur bütçesi"""
+        window = self.history_window(system_prompt, user_message, chat_history)
+        text, success = await self._run(
+            lambda lease: self._generate(lease, system_prompt, user_message, window, temperature, max_tokens or self.max_tokens),
+            timeout, "cevap"
+        )
+        if success:
+            reused, total = prefix_meter.record(f"{self.name}:{self.model}", system_prompt, window, user_message)
+            logger.info(f"{self.label} başarılı! (önek tekrarı ~{reused}/{total} token)")
+        return text, success
+    
+    async def open_stream(self, system_prompt: Optional[str], user_message: str, chat_history: list,
+                          temperature: float = 0.7, max_tokens: Optional[int] = None,
+                          timeout: Optional[float] = None) -> Tuple[Optional[AsyncIterator[str]], bool]:
+        """Akışı başlat, ilk parça gelince akışı döndür (devre kesici ilk token süresini ölçer)"""
+        window = self.history_window(system_prompt, user_message, chat_history)
+        chunks, success = await self._run(
+            lambda lease: peek_stream(self._stream(lease, system_prompt, user_message, window, temperature, max_tokens or self.max_tokens)),
+            timeout, "akış"
+        )
+        if success:
+            reused, total = prefix_meter.record(f"{self.name}:{self.model}", system_prompt, window, user_message)
+            logger.info(f"{self.label} akışı başladı! (önek tekrarı ~{reused}/{total} token)")
+        return chunks, success
+    
+    def history_window(self, system_prompt: Optional[str], user_message: str, chat_history: list) -> list:
+        """Prompt bütçesine sığan en yeni geçmiş; gönderilen token tahminini logla"""
+        fixed = estimate_tokens(system_prompt or "") + estimate_tokens(user_message)
+        window, history_tokens = select_history(chat_history, self.prompt_tokens - fixed)
+        logger.info(f"{self.label}: ~{fixed + history_tokens} token gönderiliyor "
+                    f"({len(window)}/{len(chat_history)} geçmiş mesaj, bütçe {self.prompt_tokens})")
+        return window
+    
+    async def _generate(self, lease: Any, system_prompt: Optional[str], user_message: str, chat_history: list,
+                        temperature: float, max_tokens: int) -> Optional[str]:
+        raise NotImplementedError
+    
+    def _stream(self, lease: Any, system_prompt: Optional[str], user_message: str, chat_history: list,
+                temperature: float, max_tokens: int) -> AsyncIterator[str]:
+        raise NotImplementedError
+    
+    async def close(self):
+        """Bağlantıları kapat"""
 
 # ============================================
 # GEMINI İSTEMCİSİ (YENİ SDK)
 # ============================================
 
-gemini_client = None
+@dataclass
+class GeminiKey:
+    """Tek Gemini API anahtarı/projesi: kendi limiti ve devre kesicisi"""
+    key_id: str  # kalıcı kayıt için anahtarın özeti (anahtarın kendisi yazılmaz)
+    name: str
+    client: Any
+    limiter: "RateLimitTracker"
+    breaker: CircuitBreaker
+    # GEMINI_CACHED_PREFIX: model -> (önbellek adı, bitiş zamanı monotonic); ad boşsa oluşturulamadı
+    prefix_caches: Dict[str, Tuple[str, float]] = field(default_factory=dict)
+    cache_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+@dataclass
+class GeminiLease:
+    """Tek çağrı için alınan hak: seçilen anahtar ve isteğin gönderilip gönderilmediği"""
+    key: GeminiKey
+    sent: bool = False  # gönderilmeden iptal edilirse hak iade edilir
+
+# Gemini anahtar havuzu (setup_gemini ile doldurulur)
+gemini_keys: List[GeminiKey] = []
 
 def setup_gemini():
-    """Yeni google-genai SDK ile Gemini kurulumu"""
-    global gemini_client
-    if not GEMINI_API_KEY:
+    """Yeni google-genai SDK ile Gemini kurulumu (anahtar başına bir client)"""
+    global gemini_keys
+    api_keys = [k.strip() for k in GEMINI_API_KEYS.split(",") if k.strip()]
+    if not api_keys:
         logger.error("GEMINI_API_KEY bulunamadı!")
         return None
     
-    try:
-        gemini_client = genai.Client(api_key=GEMINI_API_KEY)
-        logger.info("Gemini client oluşturuldu (yeni SDK)")
-        return gemini_client
-    except Exception as e:
-        logger.error(f"Gemini kurulum hatası: {e}")
-        return None
-
-async def ask_gemini(system_prompt: str, user_message: str, chat_history: list) -> Tuple[Optional[str], bool]:
-    """Gemini'ye sor (yeni SDK)"""
-    if not gemini_client:
-        logger.warning("Gemini client yok!")
-        return None, False
+    keys = []
+    for i, api_key in enumerate(api_keys, 1):
+        # Etiket sadece sıra numarası: /durum gruplara gider, anahtarın parçası bile gösterilmez
+        name = f"anahtar {i}"
+        try:
+            keys.append(GeminiKey(
+                key_id=hashlib.sha256(api_key.encode()).hexdigest()[:12],
+                name=name,
+                client=genai.Client(api_key=api_key),
+                limiter=RateLimitTracker(rpm=GEMINI_RPM, rpd=GEMINI_RPD),
+                breaker=CircuitBreaker(f"Gemini {name}")
+            ))
+        except Exception as e:
+            logger.error(f"Gemini kurulum hatası ({name}): {e}")
     
-    if not rate_tracker.can_use_gemini():
-        logger.warning(f"Gemini rate limit! (min: {rate_tracker.requests_this_minute}, day: {rate_tracker.requests_today}, blocked: {rate_tracker.blocked_until})")
-        return None, False
+    gemini_keys = keys
+    logger.info(f"Gemini client oluşturuldu (yeni SDK, {len(keys)} anahtar)")
+    return gemini_keys
+
+def save_rate_state():
+    """Anahtar başına limit durumunu dosyaya yaz (atomik)"""
+    if not gemini_keys:
+        return
     
+    state = {key.key_id: key.limiter.to_dict() for key in gemini_keys}
+    tmp_path = RATE_STATE_FILE + ".tmp"
     try:
-        # Mesaj geçmişini oluştur
-        contents = []
-        
-        for msg in chat_history[-10:]:
-            role = "user" if msg["role"] == "user" else "model"
-            contents.append(types.Content(
-                role=role,
-                parts=[types.Part.from_text(text=msg["content"])]
-            ))
-        
-        # Son kullanıcı mesajını ekle
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, RATE_STATE_FILE)
+    except OSError as e:
+        logger.warning(f"Limit durumu kaydedilemedi: {e}")
+
+def load_rate_state():
+    """Kaydedilmiş limit durumunu yükle (restart sonrası)"""
+    try:
+        with open(RATE_STATE_FILE, encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logger.warning(f"Limit durumu okunamadı: {e}")
+        return
+    
+    for key in gemini_keys:
+        if key.key_id in state:
+            key.limiter.load_dict(state[key.key_id])
+            logger.info(f"Limit durumu yüklendi: {key.name} ({key.limiter.requests_today} istek bugün, {key.limiter.describe()})")
+
+async def rate_state_checkpoint(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: limit durumunu periyodik kaydet"""
+    save_rate_state()
+
+def build_gemini_contents(user_message: str, chat_history: list) -> list:
+    """Mesaj geçmişinden Gemini içerik listesi oluştur"""
+    contents = []
+    
+    for msg in chat_history:
+        role = "user" if msg["role"] == "user" else "model"
         contents.append(types.Content(
-            role="user",
-            parts=[types.Part.from_text(text=user_message)]
+            role=role,
+            parts=[types.Part.from_text(text=msg["content"])]
         ))
+    
+    # Son kullanıcı mesajını ekle
+    contents.append(types.Content(
+        role="user",
+        parts=[types.Part.from_text(text=user_message)]
+    ))
+    
+    return contents
+
+class GeminiProvider(LLMProvider):
+    """Gemini (yeni google-genai SDK, async) - anahtar havuzu ile"""
+    TYPE = "gemini"
+    LABEL = "Gemini"
+    DEFAULT_MODEL = "gemini-2.0-flash"
+    DEFAULT_MAX_TOKENS = 1024
+    DEFAULT_PROMPT_TOKENS = 8000
+    
+    def available(self) -> bool:
+        if not gemini_keys:
+            logger.warning("Gemini client yok!")
+            return False
+        return True
+    
+    async def acquire(self, timeout: float) -> Optional[GeminiLease]:
+        """En çok boş kapasitesi olan anahtarı seç; hiçbiri uygun değilse en erken açılanı bekle"""
+        deadline = time.monotonic() + timeout
+        while True:
+            ready = sorted(
+                (k for k in gemini_keys if k.limiter.can_use_gemini()),
+                key=lambda k: k.limiter.headroom(),
+                reverse=True
+            )
+            for key in ready:
+                if key.breaker.allow_request():
+                    key.limiter.take()
+                    return GeminiLease(key)
+            
+            waits = [k.limiter.wait_time() for k in gemini_keys if not k.breaker.rejects()]
+            if not waits:
+                logger.info("Gemini atlandı (tüm anahtarların devresi açık)")
+                return None
+            
+            wait = max(min(waits), 0.05)
+            if time.monotonic() + wait > deadline:
+                logger.warning("Gemini rate limit! (" + "; ".join(f"{k.name}: {k.limiter.describe()}" for k in gemini_keys) + ")")
+                return None
+            await asyncio.sleep(wait)
+    
+    def breaker_for(self, lease: GeminiLease) -> CircuitBreaker:
+        return lease.key.breaker
+    
+    def has_headroom(self, min_ratio: float) -> bool:
+        return any(
+            k.limiter.can_use_gemini() and k.limiter.headroom() >= min_ratio and not k.breaker.rejects()
+            for k in gemini_keys
+        )
+    
+    def status(self) -> str:
+        lines = []
+        for key in gemini_keys:
+            key_status = "✅" if key.limiter.can_use_gemini() else "⏳ Limit"
+            lines.append(f"\n• {key.name}: {key_status} ({key.limiter.requests_today}/{GEMINI_RPD:.0f} günlük){key.breaker.badge()}")
+        return "".join(lines) if lines else "❌"
+    
+    def on_error(self, e: Exception, lease: GeminiLease, kind: str, retry_after: Optional[float]):
+        """Hatayı logla, rate limit/kota ise sadece bu anahtarı blokla"""
+        key = lease.key
+        if kind in (ERROR_RATE_LIMIT, ERROR_QUOTA):
+            seconds = key.limiter.penalize(kind, retry_after)
+            logger.warning(f"Gemini {kind} ({key.name}), {seconds:.0f}s bloklandı: {e}")
+            return
         
-        # API çağrısı
-        response = gemini_client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=contents,
-            config=types.GenerateContentConfig(
+        logger.error(f"Gemini hatası ({kind}, {key.name}): {e}")
+        if kind == ERROR_PERMANENT and key.prefix_caches.get(self.model, ("", 0.0))[0]:
+            # Önbellek sunucuda silinmiş/süresi dolmuş olabilir; sonraki istekte yeniden oluşturulur
+            del key.prefix_caches[self.model]
+            logger.info(f"Gemini önek önbelleği bırakıldı ({key.name})")
+    
+    def on_success(self, lease: GeminiLease):
+        # Limit sayaçları record_request'te güncellenir
+        pass
+    
+    def on_cancel(self, lease: GeminiLease):
+        """Hiç gönderilmeden iptal edilen istek kotadan düşmesin (gönderildiyse Google saymıştır)"""
+        if not lease.sent:
+            lease.key.limiter.refund()
+    
+    async def prefix_cache(self, key: GeminiKey) -> Optional[str]:
+        """Bu anahtar/model için sabit önek önbelleğinin adı; yoksa veya süresi bitmek üzereyse oluştur"""
+        async with key.cache_lock:
+            name, expires = key.prefix_caches.get(self.model, ("", 0.0))
+            # Süre bitmeden bir dakika önce yenile (istek sırasında düşmesin)
+            if time.monotonic() < expires - 60:
+                return name or None
+            
+            try:
+                cache = await key.client.aio.caches.create(
+                    model=self.model,
+                    config=types.CreateCachedContentConfig(
+                        display_name="munazara-prefix",
+                        system_instruction=SYSTEM_PROMPT_PREFIX,
+                        ttl=f"{GEMINI_CACHE_TTL:.0f}s"
+                    )
+                )
+            except Exception as e:
+                # Örn. önek modelin en küçük önbellek boyutunun altında; TTL boyunca normal istekle devam
+                logger.warning(f"Gemini önek önbelleği oluşturulamadı ({key.name}): {e}")
+                key.prefix_caches[self.model] = ("", time.monotonic() + GEMINI_CACHE_TTL)
+                return None
+            
+            key.prefix_caches[self.model] = (cache.name, time.monotonic() + GEMINI_CACHE_TTL)
+            logger.info(f"Gemini önek önbelleği oluşturuldu ({key.name}): {cache.name}")
+            return cache.name
+    
+    async def _request(self, lease: GeminiLease, system_prompt: Optional[str], user_message: str, chat_history: list,
+                       temperature: float, max_tokens: int) -> Tuple[list, types.GenerateContentConfig]:
+        """İçerik listesi ve ayarlar; açık önbellek kullanılabiliyorsa sabit önek önbellekten gelir"""
+        contents = build_gemini_contents(user_message, chat_history)
+        
+        cache_name = None
+        if GEMINI_CACHED_PREFIX and system_prompt and system_prompt.startswith(SYSTEM_PROMPT_PREFIX):
+            cache_name = await self.prefix_cache(lease.key)
+        if not cache_name:
+            return contents, types.GenerateContentConfig(
                 system_instruction=system_prompt,
-                temperature=0.7,
-                max_output_tokens=1024
+                temperature=temperature,
+                max_output_tokens=max_tokens
             )
-        )
         
-        rate_tracker.record_request()
-        logger.info("Gemini başarılı!")
-        return response.text, True
+        # Önbellekli istekte system_instruction verilemez; oturum bölümü ilk kullanıcı içeriğinin başına
+        session_part = types.Part.from_text(text=system_prompt[len(SYSTEM_PROMPT_PREFIX):])
+        if contents[0].role == "user":
+            contents[0].parts.insert(0, session_part)
+        else:
+            contents.insert(0, types.Content(role="user", parts=[session_part]))
+        return contents, types.GenerateContentConfig(
+            cached_content=cache_name,
+            temperature=temperature,
+            max_output_tokens=max_tokens
+        )
     
-    except Exception as e:
-        error_str = str(e).lower()
-        if "429" in str(e) or "resource_exhausted" in error_str or "quota" in error_str:
-            logger.warning(f"Gemini rate limit: {e}")
-            rate_tracker.block(60)
-            return None, False
-        
-        logger.error(f"Gemini hatası: {e}")
-        return None, False
+    async def _generate(self, lease, system_prompt, user_message, chat_history, temperature, max_tokens):
+        contents, config = await self._request(lease, system_prompt, user_message, chat_history, temperature, max_tokens)
+        # API çağrısı (async - event loop'u bloklamaz)
+        lease.sent = True
+        response = await lease.key.client.aio.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=config
+        )
+        lease.key.limiter.record_request()
+        return response.text
+    
+    async def _stream(self, lease, system_prompt, user_message, chat_history, temperature, max_tokens):
+        contents, config = await self._request(lease, system_prompt, user_message, chat_history, temperature, max_tokens)
+        lease.sent = True
+        stream = await lease.key.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config=config
+        )
+        lease.key.limiter.record_request()
+        async for chunk in stream:
+            yield chunk.text or ""
+    
+    async def close(self):
+        """Bu modelin önek önbelleklerini sil (TTL'i beklemeden depolama ücreti dursun)"""
+        for key in gemini_keys:
+            name, _ = key.prefix_caches.pop(self.model, ("", 0.0))
+            if not name:
+                continue
+            try:
+                await key.client.aio.caches.delete(name=name)
+            except Exception as e:
+                logger.warning(f"Gemini önek önbelleği silinemedi ({key.name}): {e}")
 
 # ============================================
 # OPENROUTER İSTEMCİSİ (YEDEK)
@@ -381,84 +1445,867 @@ async def ask_gemini(system_prompt: str, user_message: str, chat_history: list)
 openrouter_client = None
 
 def setup_openrouter():
-    """OpenRouter kurulumu"""
+    """OpenRouter kurulumu (AsyncOpenAI + paylaşımlı bağlantı havuzu)"""
     global openrouter_client
     if not OPENROUTER_API_KEY:
         logger.error("OPENROUTER_API_KEY bulunamadı!")
         return None
     
-    openrouter_client = OpenAI(
+    # h2 paketi kuruluysa HTTP/2, değilse HTTP/1.1 keep-alive
+    use_http2 = importlib.util.find_spec("h2") is not None
+    
+    http_client = DefaultAsyncHttpxClient(
+        http2=use_http2,
+        limits=httpx.Limits(
+            max_connections=OPENROUTER_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENROUTER_MAX_KEEPALIVE,
+            keepalive_expiry=OPENROUTER_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(OPENROUTER_TIMEOUT, connect=OPENROUTER_CONNECT_TIMEOUT)
+    )
+    
+    openrouter_client = AsyncOpenAI(
         base_url="https://openrouter.ai/api/v1",
         api_key=OPENROUTER_API_KEY,
+        http_client=http_client,
         default_headers={
             "HTTP-Referer": "https://github.com/munazara-bot",
             "X-Title": "Munazara GPT Bot"
         }
     )
+    logger.info(f"OpenRouter client oluşturuldu (async, HTTP/2: {'✅' if use_http2 else '❌'})")
     return openrouter_client
 
-async def ask_openrouter(system_prompt: str, user_message: str, chat_history: list) -> Tuple[Optional[str], bool]:
-    """OpenRouter (DeepSeek R1) ile sor"""
-    if not openrouter_client:
-        logger.warning("OpenRouter client yok!")
-        return None, False
+async def close_openrouter():
+    """Paylaşımlı HTTP bağlantılarını kapat"""
+    if openrouter_client:
+        await openrouter_client.close()
+
+def build_openrouter_messages(system_prompt: Optional[str], user_message: str, chat_history: list) -> list:
+    """Mesaj geçmişinden OpenAI formatında mesaj listesi oluştur"""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    
+    for msg in chat_history:
+        messages.append({
+            "role": msg["role"],
+            "content": msg["content"]
+        })
+    
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+class OpenRouterProvider(LLMProvider):
+    """OpenRouter (OpenAI uyumlu, async)"""
+    TYPE = "openrouter"
+    LABEL = "DeepSeek"
+    DEFAULT_MODEL = "meta-llama/llama-3.3-70b-instruct:free"
+    DEFAULT_MAX_TOKENS = 2048
+    DEFAULT_TIMEOUT = OPENROUTER_TIMEOUT
+    
+    def available(self) -> bool:
+        if not openrouter_client:
+            logger.warning("OpenRouter client yok!")
+            return False
+        return True
     
-    try:
-        messages = [{"role": "system", "content": system_prompt}]
+    def status(self) -> str:
+        return ("✅ Yedek hazır" if openrouter_client else "❌") + self.breaker.badge()
+    
+    async def _generate(self, lease, system_prompt, user_message, chat_history, temperature, max_tokens):
+        logger.info("OpenRouter API çağrılıyor...")
+        response = await openrouter_client.chat.completions.create(
+            model=self.model,
+            messages=build_openrouter_messages(system_prompt, user_message, chat_history),
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        return response.choices[0].message.content
+    
+    async def _stream(self, lease, system_prompt, user_message, chat_history, temperature, max_tokens):
+        logger.info("OpenRouter akışı çağrılıyor...")
+        stream = await openrouter_client.chat.completions.create(
+            model=self.model,
+            messages=build_openrouter_messages(system_prompt, user_message, chat_history),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
+    
+    async def close(self):
+        await close_openrouter()
+
+# ============================================
+# STUB SAĞLAYICI (Offline yük testi)
+# ============================================
+
+class StubProvider(LLMProvider):
+    """
+    Deterministik yerel sağlayıcı - ağ çağrısı yapmaz.
+    Gecikme ve hata oranı ayarlanabilir; aynı seed aynı diziyi üretir.
+    """
+    TYPE = "stub"
+    LABEL = "Stub"
+    DEFAULT_MODEL = "stub-1"
+    
+    def __init__(self, name: str, latency: float = 0.5, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0, **kwargs):
+        super().__init__(name, **kwargs)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+    
+    def _reply(self, user_message: str) -> str:
+        """Mesajdan türetilen sabit cevap"""
+        if "KONU:" in user_message:
+            return "\n".join(f"KONU: Stub konu {i}" for i in range(1, 7))
+        
+        return (
+            f"Şunu diyorsun: {user_message[:80]}. Doğru mu?\n\n"
+            f"Bu durumda iddianı neye dayandırıyorsun?\n\n"
+            f"1️⃣ Pes ettim | 2️⃣ Benim yerime cevap ver | 3️⃣ Geç"
+        )
+    
+    async def _simulate(self):
+        """Ayarlı gecikmeyi bekle, hata oranına göre hata fırlat"""
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        fail = self.rng.random() < self.error_rate
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("Stub: simüle edilmiş hata")
+    
+    async def _generate(self, lease, system_prompt, user_message, chat_history, temperature, max_tokens):
+        await self._simulate()
+        return self._reply(user_message)
+    
+    async def _stream(self, lease, system_prompt, user_message, chat_history, temperature, max_tokens):
+        await self._simulate()
+        for word in self._reply(user_message).split(" "):
+            yield word + " "
+            await asyncio.sleep(0.02)
+
+# ============================================
+# SAĞLAYICI KAYIT DEFTERİ
+# ============================================
+
+PROVIDER_TYPES = {cls.TYPE: cls for cls in (GeminiProvider, OpenRouterProvider, StubProvider)}
+
+# Sıralı sağlayıcı zinciri (setup_providers ile doldurulur)
+providers: List[LLMProvider] = []
+
+def load_provider_config() -> List[Dict[str, Any]]:
+    """
+    Sağlayıcı zincirini oku.
+    LLM_CONFIG_FILE varsa JSON: {"providers": [{"type": "gemini", "model": ..., "timeout": ..., "max_tokens": ..., "prompt_tokens": ...}, ...]}
+    Yoksa LLM_PROVIDERS sırası + <TİP>_MODEL / <TİP>_TIMEOUT / <TİP>_MAX_TOKENS / <TİP>_PROMPT_TOKENS ortam değişkenleri
+    """
+    if LLM_CONFIG_FILE:
+        try:
+            with open(LLM_CONFIG_FILE, encoding="utf-8") as f:
+                return json.load(f)["providers"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"LLM config okunamadı ({LLM_CONFIG_FILE}): {e}")
+    
+    entries = []
+    for kind in LLM_PROVIDERS.split(","):
+        kind = kind.strip().lower()
+        if not kind:
+            continue
+        
+        prefix = kind.upper()
+        entry = {
+            "type": kind,
+            "model": os.getenv(f"{prefix}_MODEL", ""),
+            "timeout": env_float(f"{prefix}_TIMEOUT", 0),
+            "max_tokens": env_int(f"{prefix}_MAX_TOKENS", 0),
+            "prompt_tokens": env_int(f"{prefix}_PROMPT_TOKENS", 0)
+        }
+        if kind == "stub":
+            entry.update(
+                latency=env_float("STUB_LATENCY", 0.5),
+                jitter=env_float("STUB_JITTER", 0.0),
+                error_rate=env_float("STUB_ERROR_RATE", 0.0),
+                seed=env_int("STUB_SEED", 0)
+            )
+        entries.append(entry)
+    
+    return entries
+
+def setup_providers() -> List[LLMProvider]:
+    """Config'e göre sağlayıcı zincirini kur"""
+    global providers
+    chain = []
+    
+    for entry in load_provider_config():
+        entry = dict(entry)
+        kind = entry.pop("type", "")
+        provider_cls = PROVIDER_TYPES.get(kind)
+        if not provider_cls:
+            logger.error(f"Bilinmeyen sağlayıcı tipi: {kind}")
+            continue
+        chain.append(provider_cls(entry.pop("name", kind), **entry))
+    
+    providers = chain
+    logger.info("LLM zinciri: " + " → ".join(f"{p.label} ({p.model})" for p in providers))
+    return providers
+
+async def close_providers():
+    """Tüm sağlayıcı bağlantılarını kapat"""
+    for provider in providers:
+        await provider.close()
+
+# ============================================
+# LLM ZAMANLAYICI (Ağırlıklı adil sıra)
+# ============================================
+
+PRIORITY_INTERACTIVE = "tartışma"
+PRIORITY_BACKGROUND = "arka plan"
+PRIORITY_WEIGHTS = {
+    PRIORITY_INTERACTIVE: LLM_WEIGHT_INTERACTIVE,
+    PRIORITY_BACKGROUND: LLM_WEIGHT_BACKGROUND,
+}
+
+class LLMScheduler:
+    """
+    Tüm LLM işleri için ortak kuyruk (weighted fair queuing).
+    Her (sohbet, öncelik) bir akış; iş, akışın ağırlığıyla orantılı sanal bitiş
+    zamanı alır ve en küçük bitiş zamanlı iş önce çalışır. Böylece kalabalık bir
+    grup diğerlerini aç bırakmaz, tartışma turları arka plan işlerinin önüne geçer.
+    """
+    
+    def __init__(self, slots: int):
+        self.slots = max(1, slots)
+        self.running = 0
+        self.virtual_time = 0.0
+        self.seq = 0
+        self.queue: List[Tuple[float, int, str, asyncio.Future]] = []  # heap: (bitiş, sıra, öncelik, future)
+        self.last_finish: Dict[Tuple[int, str], float] = {}
+        self.waits: Dict[str, deque] = {p: deque(maxlen=100) for p in PRIORITY_WEIGHTS}
+    
+    def depth(self, priority: str) -> int:
+        return sum(1 for _, _, p, future in self.queue if p == priority and not future.done())
+    
+    def _enqueue(self, chat_id: int, priority: str) -> asyncio.Future:
+        flow = (chat_id, priority)
+        start = max(self.virtual_time, self.last_finish.get(flow, 0.0))
+        finish = start + 1.0 / PRIORITY_WEIGHTS.get(priority, 1.0)
+        self.last_finish[flow] = finish
         
-        for msg in chat_history[-10:]:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        if len(self.last_finish) > 1000:
+            # Sanal zamanın gerisinde kalan akışların kaydı gereksiz
+            self.last_finish = {f: t for f, t in self.last_finish.items() if t > self.virtual_time}
         
-        messages.append({"role": "user", "content": user_message})
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.queue, (finish, self.seq, priority, future))
+        return future
+    
+    def _dispatch(self):
+        while self.running < self.slots and self.queue:
+            finish, _, _, future = heapq.heappop(self.queue)
+            if future.done():
+                continue  # beklerken iptal edilmiş
+            self.virtual_time = finish
+            self.running += 1
+            future.set_result(None)
+    
+    def _release(self):
+        self.running -= 1
+        self._dispatch()
+    
+    @asynccontextmanager
+    async def slot(self, chat_id: int, priority: str, budget: float):
+        """
+        Sıra bekle ve LLM işi için slot al; bütçeden kalan süreyi verir.
+        Bütçe sırada biterse asyncio.TimeoutError.
+        """
+        loop = asyncio.get_running_loop()
+        queued_at = loop.time()
+        future = self._enqueue(chat_id, priority)
+        self._dispatch()
         
-        logger.info("OpenRouter API çağrılıyor...")
-        response = openrouter_client.chat.completions.create(
-            model="meta-llama/llama-3.3-70b-instruct:free",
-            messages=messages,
-            max_tokens=2048,
-            temperature=0.7
-        )
+        try:
+            await asyncio.wait_for(asyncio.shield(future), budget)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if future.done() and not future.cancelled():
+                self._release()  # slot verilmişti ama alan kalmadı
+            else:
+                future.cancel()
+            raise
+        
+        waited = loop.time() - queued_at
+        self.waits.setdefault(priority, deque(maxlen=100)).append(waited)
+        if waited >= 1:
+            logger.info(f"LLM kuyruğu: {priority} işi {waited:.1f}s bekledi (sohbet {chat_id})")
         
-        logger.info("OpenRouter başarılı!")
-        return response.choices[0].message.content, True
+        try:
+            yield budget - waited
+        finally:
+            self._release()
     
-    except Exception as e:
-        logger.error(f"OpenRouter hatası: {e}")
-        return None, False
+    def describe(self) -> str:
+        """Öncelik sınıfı başına kuyruk derinliği ve bekleme süresi"""
+        parts = []
+        for priority, waits in self.waits.items():
+            avg = sum(waits) / len(waits) if waits else 0.0
+            worst = max(waits) if waits else 0.0
+            parts.append(f"{priority}: {self.depth(priority)} sırada, bekleme ort. {avg:.1f}s / en çok {worst:.1f}s")
+        return f"{self.running}/{self.slots} çalışıyor\n" + "\n".join(f"• {p}" for p in parts)
+
+llm_scheduler = LLMScheduler(LLM_CONCURRENCY)
+
+# ============================================
+# YANIT ÖNBELLEĞİ (Araştırma ve konu üretimi)
+# ============================================
+
+class ResponseCache:
+    """
+    Deterministik promptlar için içerik adresli önbellek.
+    Anahtar: normalize prompt + model zinciri + sıcaklık + max token.
+    TTL ile eskir, boyut dolunca en uzun süredir kullanılmayan atılır.
+    """
+    
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()  # anahtar -> {response, model, created}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+    
+    @staticmethod
+    def make_key(prompt: str, temperature: float, max_tokens: int) -> str:
+        normalized = " ".join(prompt.split()).casefold()
+        chain = ",".join(f"{p.name}:{p.model}" for p in providers)
+        raw = f"{chain}|{temperature:g}|{max_tokens}|{normalized}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        entry = self.entries.get(key)
+        if entry and time.time() - entry["created"] < self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["response"], entry["model"]
+        
+        if entry:
+            del self.entries[key]
+            self.dirty = True
+        self.misses += 1
+        return None
+    
+    def put(self, key: str, response: str, model: str):
+        self.entries[key] = {"response": response, "model": model, "created": time.time()}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+    
+    def save(self):
+        """Değiştiyse dosyaya yaz (atomik)"""
+        if not self.dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self.entries.items()), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"Yanıt önbelleği kaydedilemedi: {e}")
+    
+    def load(self):
+        """Kaydedilmiş önbelleği yükle, süresi geçenleri at"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Yanıt önbelleği okunamadı: {e}")
+            return
+        
+        now = time.time()
+        for key, entry in items:
+            if now - entry.get("created", 0) < self.ttl:
+                self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        logger.info(f"Yanıt önbelleği yüklendi: {len(self.entries)} kayıt")
+    
+    def describe(self) -> str:
+        total = self.hits + self.misses
+        rate = f" (%{100 * self.hits / total:.0f})" if total else ""
+        return f"{len(self.entries)} kayıt, {self.hits} isabet / {self.misses} ıskalama{rate}"
+
+response_cache = ResponseCache(RESPONSE_CACHE_FILE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE)
+
+async def response_cache_checkpoint(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: önbelleği periyodik kaydet"""
+    response_cache.save()
 
 # ============================================
 # FALLBACK SİSTEMİ
 # ============================================
 
+NO_RESPONSE_TEXT = "⚠️ Şu anda yanıt veremiyorum. Lütfen biraz sonra tekrar deneyin."
+
+# Başarılı çağrı süreleri (saniye): {(sağlayıcı, çağrı türü): deque}
+# Akışta ilk token süresi, tek seferde tam cevap süresi ölçülür; ayrı tutulur
+provider_latencies: Dict[Tuple[str, str], deque] = {}
+
+# Hedge istatistikleri
+hedge_stats = {"fired": 0, "won": 0}
+
+# Kaybeden ama iptal edilmeyen görevlerin referansları (GC'ye gitmesin)
+background_tasks: set = set()
+
+def record_latency(name: str, action: str, seconds: float):
+    """Başarılı çağrı süresini kaydet"""
+    provider_latencies.setdefault((name, action), deque(maxlen=100)).append(seconds)
+
+def get_hedge_delay(name: str, action: str) -> float:
+    """Hedge gecikmesi: sabit saniye veya gözlenen yüzdelik (örn. p90)"""
+    if not HEDGE_DELAY.lower().startswith("p"):
+        try:
+            return float(HEDGE_DELAY)
+        except ValueError:
+            return HEDGE_DELAY_DEFAULT
+    
+    samples = sorted(provider_latencies.get((name, action), []))
+    if len(samples) < 10:
+        return HEDGE_DELAY_DEFAULT
+    
+    try:
+        percentile = int(HEDGE_DELAY[1:])
+    except ValueError:
+        percentile = 90
+    index = min(len(samples) - 1, len(samples) * percentile // 100)
+    return samples[index]
+
+async def race_providers(attempts: List[Tuple[str, Callable[[float], Awaitable[Tuple[Optional[Any], bool]]]]],
+                         budget: float, action: str = "cevap") -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Sağlayıcıları sırayla dene, birincil geç kalırsa sıradakini paralel başlat (hedge).
+    Her deneme bütçeden kalan süreyi alır; bütçe biterse hepsi iptal edilir.
+    action: "cevap" (tam cevap) veya "akış" (ilk token) - hedge gecikmesi bu türün ölçümünden
+    İlk başarılı cevabı döndürür: (cevap, sağlayıcı adı)
+    """
+    queue = list(attempts)
+    pending: Dict[asyncio.Task, Tuple[str, float, bool]] = {}  # görev -> (isim, başlangıç, hedge mi)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    primary = queue[0][0] if queue else ""
+    
+    def start_next(hedged: bool):
+        name, factory = queue.pop(0)
+        task = asyncio.create_task(factory(deadline - loop.time()))
+        pending[task] = (name, loop.time(), hedged)
+    
+    try:
+        while pending or queue:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.warning(f"Gecikme bütçesi doldu ({budget:g}s), denemeler iptal ediliyor")
+                return None, None
+            
+            if not pending:
+                start_next(hedged=False)
+            
+            can_hedge = HEDGE_ENABLED and queue and len(pending) < HEDGE_MAX_PARALLEL
+            hedge_delay = get_hedge_delay(primary, action) if can_hedge else None
+            timeout = min(hedge_delay, remaining) if hedge_delay is not None else remaining
+            
+            done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            
+            if not done:
+                if not can_hedge or loop.time() >= deadline:
+                    continue
+                # Birincil hâlâ cevap vermedi - yedeği de başlat
+                hedge_stats["fired"] += 1
+                logger.info(f"Hedge tetiklendi ({hedge_delay:.1f}s): {queue[0][0]} paralel başlatılıyor")
+                start_next(hedged=True)
+                continue
+            
+            for task in done:
+                name, started, hedged = pending.pop(task)
+                try:
+                    response, success = task.result()
+                except Exception as e:
+                    logger.error(f"{name} beklenmeyen hata: {e}")
+                    continue
+                
+                if success and response:
+                    record_latency(name, action, loop.time() - started)
+                    if hedged:
+                        hedge_stats["won"] += 1
+                    return response, name
+                
+                logger.info(f"{name} başarısız, sıradaki deneniyor...")
+        
+        return None, None
+    
+    except asyncio.CancelledError:
+        # Tur iptal edildi - hiçbir deneme arka planda sürmesin
+        for task in pending:
+            task.cancel()
+        raise
+    
+    finally:
+        # Kaybeden görevler
+        for task in pending:
+            if HEDGE_CANCEL_LOSER:
+                task.cancel()
+            else:
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+
+def recent_history(session: MunazaraSession) -> list:
+    """Henüz özete katlanmamış mesajlar (eskileri özet olarak sistem promptunda)"""
+    return session.chat_history[session.summarized_upto:]
+
+def maybe_summarize(session: MunazaraSession):
+    """Yeterince eski mesaj biriktiyse arka planda (düşük öncelikle) özete katla"""
+    if SUMMARY_BATCH_MESSAGES <= 0 or session.summary_task:
+        return
+    
+    end = len(session.chat_history) - SUMMARY_KEEP_MESSAGES
+    if end - session.summarized_upto < SUMMARY_BATCH_MESSAGES:
+        return
+    
+    session.summary_task = asyncio.create_task(summarize_history(session, session.summarized_upto, end))
+
+async def summarize_history(session: MunazaraSession, start: int, end: int):
+    """chat_history[start:end] mesajlarını mevcut özetle birleştir"""
+    try:
+        lines = "\n".join(
+            f"{'KULLANICI' if msg['role'] == 'user' else 'BOT'}: {msg['content']}"
+            for msg in session.chat_history[start:end]
+        )
+        prompt = f"""Bir münazaranın mevcut özetini ve yeni konuşma bölümünü birleştir.
+
+SAVUNAN (kullanıcı): {session.user_position}
+SALDIRAN (bot): {session.bot_position}
+KONU: {session.topic}
+
+MEVCUT ÖZET:
+{session.summary or "(yok)"}
+
+YENİ BÖLÜM:
+{lines}
+
+GÖREV: Güncellenmiş tek bir özet yaz.
+- Kullanıcı tarafının HER iddiasını ve cevabını kısa maddelerle koru ([isim] ile)
+- Kabul edilen ("haklısın") ve askıya alınan noktaları belirt
+- Botun cevaplarını sadece bağlam için çok kısa geç
+- En fazla 250 kelime, sadece maddeler"""
+        
+        response, _ = await ask_llm(prompt, temperature=0.2, max_tokens=SUMMARY_MAX_TOKENS,
+                                    budget=SUMMARY_BUDGET, chat_id=session.chat_id)
+        if response:
+            session.summary = response.strip()
+            session.bump_settings()
+            session.summarized_upto = end
+            logger.info(f"Geçmiş özetlendi (sohbet {session.chat_id}): {end} mesaj özette, "
+                        f"~{estimate_tokens(session.summary)} token")
+    except Exception as e:
+        logger.warning(f"Özetleme hatası (sohbet {session.chat_id}): {e}")
+    finally:
+        session.summary_task = None
+
 async def get_ai_response(session: MunazaraSession, user_message: str) -> Tuple[str, str]:
-    """Fallback sistemli AI cevabı"""
+    """Fallback + hedge sistemli AI cevabı"""
     
     system_prompt = get_system_prompt(session)
     
-    # 1. Gemini dene
-    logger.info(f"Gemini deneniyor... (can_use: {rate_tracker.can_use_gemini()}, client: {gemini_client is not None})")
-    response, success = await ask_gemini(system_prompt, user_message, session.chat_history)
-    if success and response:
-        return response, "Gemini"
+    try:
+        async with llm_scheduler.slot(session.chat_id, PRIORITY_INTERACTIVE, TURN_BUDGET) as budget:
+            response, model_used = await race_providers([
+                (p.label, lambda remaining, p=p: p.generate(system_prompt, user_message, recent_history(session), timeout=remaining))
+                for p in providers
+            ], budget=budget)
+    except asyncio.TimeoutError:
+        logger.warning(f"LLM kuyruğu tur bütçesini aştı ({TURN_BUDGET:g}s)")
+        response, model_used = None, None
+    if response:
+        return response, model_used
+    
+    logger.error("Tüm API'ler başarısız!")
+    return NO_RESPONSE_TEXT, "Yok"
+
+async def ask_llm(prompt: str, temperature: float, max_tokens: int, budget: float,
+                  chat_id: int = 0, priority: str = PRIORITY_BACKGROUND,
+                  cache: bool = False) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Geçmişsiz tek prompt (araştırma, konu üretimi): (cevap, model) veya (None, None).
+    cache=True ise aynı prompt için önbellekteki cevap kullanılır.
+    """
+    cache_key = ResponseCache.make_key(prompt, temperature, max_tokens) if cache else None
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached:
+            logger.info(f"Önbellekten cevap ({cached[1]}, sohbet {chat_id})")
+            return cached
+    
+    try:
+        async with llm_scheduler.slot(chat_id, priority, budget) as remaining_budget:
+            response, model_used = await race_providers([
+                (p.label, lambda remaining, p=p: p.generate(None, prompt, [], temperature=temperature, max_tokens=max_tokens, timeout=remaining))
+                for p in providers
+            ], budget=remaining_budget)
+    except asyncio.TimeoutError:
+        logger.warning(f"LLM kuyruğu bütçeyi aştı ({budget:g}s, {priority})")
+        return None, None
+    
+    if cache_key and response:
+        response_cache.put(cache_key, response, model_used)
+    return response, model_used
+
+async def stream_ai_response(session: MunazaraSession, user_message: str, budget: float) -> Tuple[Optional[AsyncIterator[str]], str]:
+    """Akışlı AI cevabı: ilk token'ı üreten sağlayıcı kazanır (hedge dahil)"""
+    
+    system_prompt = get_system_prompt(session)
     
-    # 2. OpenRouter dene
-    logger.info(f"Gemini başarısız, OpenRouter'a geçiliyor... (client: {openrouter_client is not None})")
-    response, success = await ask_openrouter(system_prompt, user_message, session.chat_history)
-    if success and response:
-        return response, "DeepSeek"
+    stream, model_used = await race_providers([
+        (p.label, lambda remaining, p=p: p.open_stream(system_prompt, user_message, recent_history(session), timeout=remaining))
+        for p in providers
+    ], budget=budget, action="akış")
+    if stream:
+        return stream, model_used
     
     logger.error("Tüm API'ler başarısız!")
-    return "⚠️ Şu anda yanıt veremiyorum. Lütfen biraz sonra tekrar deneyin.", "Yok"
+    return None, "Yok"
+
+async def stream_ai_reply(update: Update, session: MunazaraSession, user_message: str) -> Tuple[str, str, Optional[Message]]:
+    """
+    Cevabı akış halinde üret: ilk parçada yanıt mesajı at, sonra throttled düzenle.
+    LLM slotu akış bitene kadar tutulur.
+    Döndürür: (tam cevap, model, gönderilen mesaj veya None)
+    """
+    try:
+        async with llm_scheduler.slot(session.chat_id, PRIORITY_INTERACTIVE, TURN_BUDGET) as budget:
+            return await stream_reply_within(update, session, user_message, budget)
+    except asyncio.TimeoutError:
+        logger.warning(f"LLM kuyruğu tur bütçesini aştı ({TURN_BUDGET:g}s)")
+        return NO_RESPONSE_TEXT, "Yok", None
+
+async def stream_reply_within(update: Update, session: MunazaraSession, user_message: str,
+                              budget: float) -> Tuple[str, str, Optional[Message]]:
+    """stream_ai_reply gövdesi: akış ve düzenlemeler verilen bütçe içinde"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    
+    stream, model_used = await stream_ai_response(session, user_message, budget=budget)
+    if not stream:
+        return NO_RESPONSE_TEXT, model_used, None
+    
+    chunks = stream.__aiter__()
+    text = ""
+    shown = ""
+    reply = None
+    last_edit = 0.0
+    
+    try:
+        while True:
+            # Akışın geri kalanı da tur bütçesine tabi
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, deadline - loop.time()))
+            except StopAsyncIteration:
+                break
+            
+            text += chunk
+            now = loop.time()
+            
+            if reply is None:
+                # İlk görünür metin - yer tutucu yanıt
+                reply = await update.message.reply_text(
+                    text + " ▌",
+                    reply_to_message_id=update.message.message_id
+                )
+                shown, last_edit = text, now
+            elif now - last_edit >= STREAM_EDIT_INTERVAL and text != shown:
+                try:
+                    await reply.edit_text(text + " ▌")
+                except Exception as e:
+                    logger.warning(f"Akış düzenleme hatası: {e}")
+                shown, last_edit = text, now
+    
+    except asyncio.CancelledError:
+        # Tur geçersiz kaldı - yarım cevap ekranda kalmasın
+        if reply:
+            try:
+                await reply.delete()
+            except Exception as e:
+                logger.warning(f"Yarım cevap silinemedi: {e}")
+        raise
+    
+    except asyncio.TimeoutError:
+        logger.warning(f"{model_used} akışı tur bütçesini aştı ({budget:.1f}s), kısmi cevap kullanılıyor")
+        if not text.strip():
+            return NO_RESPONSE_TEXT, "Yok", reply
+    
+    except Exception as e:
+        logger.error(f"{model_used} akış hatası: {e}")
+        if not text.strip():
+            return NO_RESPONSE_TEXT, "Yok", reply
+    
+    return text, model_used, reply
+
+# ============================================
+# KONU KÜTÜPHANESİ
+# ============================================
+
+def normalize_position(text: str) -> str:
+    """Pozisyon/konu adını karşılaştırma için sadeleştir (büyük-küçük harf, Türkçe karakter, noktalama)"""
+    text = text.replace("I", "ı").replace("İ", "i").casefold().replace("ı", "i")
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+class TopicLibrary:
+    """
+    (savunan, saldıran, konu) → saldırı konuları.
+    Küratörlü kayıtlar repodaki dosyadan, öğrenilenler canlı araştırmalardan gelir;
+    ilk kullanımda yüklenir, öğrenilenler ayrı dosyaya yazılır.
+    """
+    
+    def __init__(self, curated_path: str, learned_path: str):
+        self.curated_path = curated_path
+        self.learned_path = learned_path
+        self.entries: Dict[Tuple[str, str, str], Dict[str, Any]] = {}  # anahtar -> {topics, updated, source}
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(user_position: str, bot_position: str, topic: str) -> Tuple[str, str, str]:
+        return normalize_position(user_position), normalize_position(bot_position), normalize_position(topic)
+    
+    def _read(self, path: str) -> List[Dict[str, Any]]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f).get("entries", [])
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Konu kütüphanesi okunamadı ({path}): {e}")
+            return []
+    
+    def load(self):
+        """Öğrenilenleri, üstüne küratörlü kayıtları yükle (aynı çiftte küratörlü kazanır)"""
+        self.loaded = True
+        for source, path in (("learned", self.learned_path), ("curated", self.curated_path)):
+            for item in self._read(path):
+                topics = [t for t in item.get("topics", []) if t]
+                if not topics:
+                    continue
+                key = self.make_key(item.get("user_position", ""), item.get("bot_position", ""), item.get("topic", ""))
+                self.entries[key] = {
+                    "user_position": item.get("user_position", ""),
+                    "bot_position": item.get("bot_position", ""),
+                    "topic": item.get("topic", ""),
+                    "topics": topics,
+                    "updated": item.get("updated", 0),
+                    "source": source,
+                }
+        logger.info(f"Konu kütüphanesi yüklendi: {len(self.entries)} pozisyon çifti")
+    
+    def lookup(self, user_position: str, bot_position: str, topic: str) -> Optional[Dict[str, Any]]:
+        if not self.loaded:
+            self.load()
+        
+        entry = self.entries.get(self.make_key(user_position, bot_position, topic))
+        if entry:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+    
+    def needs_refresh(self, entry: Dict[str, Any]) -> bool:
+        """Sadece öğrenilen kayıtlar eskir; küratörlü kayıtlar elle güncellenir"""
+        if entry["source"] == "curated":
+            return False
+        return time.time() - entry["updated"] > TOPIC_LIBRARY_REFRESH_AGE
+    
+    def learn(self, user_position: str, bot_position: str, topic: str, topics: List[str]):
+        """Canlı araştırma sonucunu kaydet (öğrenilenler dosyasına atomik yazılır)"""
+        if not self.loaded:
+            self.load()
+        
+        key = self.make_key(user_position, bot_position, topic)
+        if self.entries.get(key, {}).get("source") == "curated":
+            logger.info(f"Küratörlü kayıt korunuyor, öğrenilen konular yazılmadı: {user_position} vs {bot_position}")
+            return
+        
+        self.entries[key] = {
+            "user_position": user_position,
+            "bot_position": bot_position,
+            "topic": topic,
+            "topics": topics,
+            "updated": time.time(),
+            "source": "learned",
+        }
+        
+        learned = [
+            {k: v for k, v in entry.items() if k != "source"}
+            for entry in self.entries.values() if entry["source"] == "learned"
+        ]
+        tmp_path = self.learned_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "entries": learned}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.learned_path)
+        except OSError as e:
+            logger.warning(f"Öğrenilen konular kaydedilemedi: {e}")
+    
+    def describe(self) -> str:
+        return f"{len(self.entries)} çift, {self.hits} isabet / {self.misses} ıskalama"
+
+topic_library = TopicLibrary(TOPIC_LIBRARY_FILE, TOPIC_LIBRARY_LEARNED_FILE)
+
+# Arka planda yenilenen kütüphane anahtarları (aynı çift iki kez yenilenmesin)
+library_refreshes: set = set()
+
+def schedule_library_refresh(session: MunazaraSession):
+    """Kütüphane kaydını arka planda canlı araştırmayla yenile (oturumu etkilemez)"""
+    key = TopicLibrary.make_key(session.user_position, session.bot_position, session.topic)
+    if key in library_refreshes:
+        return
+    library_refreshes.add(key)
+    
+    # Oturum sıfırlanabilir; sadece pozisyonların kopyasıyla çalış
+    snapshot = MunazaraSession(
+        chat_id=session.chat_id,
+        user_position=session.user_position,
+        bot_position=session.bot_position,
+        topic=session.topic
+    )
+    
+    async def refresh():
+        try:
+            _, topics = await research_topics(snapshot, cache=False)
+            if topics:
+                topic_library.learn(snapshot.user_position, snapshot.bot_position, snapshot.topic, topics)
+                logger.info(f"Konu kütüphanesi yenilendi: {snapshot.user_position} vs {snapshot.bot_position}")
+        except Exception as e:
+            logger.warning(f"Konu kütüphanesi yenilenemedi: {e}")
+        finally:
+            library_refreshes.discard(key)
+    
+    task = asyncio.create_task(refresh())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
 # ============================================
 # WEB ARAŞTIRMASI (Ayarlar sonrası)
 # ============================================
 
-async def do_research(session: MunazaraSession) -> Tuple[str, List[str]]:
-    """Pozisyonlar hakkında web araştırması yap ve konu başlıkları döndür"""
+async def research_topics(session: MunazaraSession, cache: bool = True) -> Tuple[str, List[str]]:
+    """Pozisyonlar hakkında canlı araştırma yap: (araştırma metni, konular); başarısızsa konular boş"""
     
     research_prompt = f"""Sen bir münazara uzmanısın. İki pozisyon arasındaki TEMEL ANLAŞMAZLIK NOKTALARINI belirle.
 
@@ -490,17 +2337,10 @@ KONU: İç tutarsızlık iddiaları
     research_text = ""
     
     try:
-        if gemini_client and rate_tracker.can_use_gemini():
-            response = gemini_client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=research_prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.3,
-                    max_output_tokens=800
-                )
-            )
-            rate_tracker.record_request()
-            research_text = response.text
+        response, _ = await ask_llm(research_prompt, temperature=0.3, max_tokens=800, budget=RESEARCH_BUDGET,
+                                    chat_id=session.chat_id, cache=cache)
+        if response:
+            research_text = response
             
             # Konuları parse et
             for line in research_text.split('\n'):
@@ -523,20 +2363,102 @@ KONU: İç tutarsızlık iddiaları
     except Exception as e:
         logger.warning(f"Araştırma hatası: {e}")
     
-    # Fallback konular - daha anlamlı
-    if not topics:
-        topics = [
-            f"{session.user_position} görüşünün temel tanımı ve sınırları",
-            f"{session.bot_position} açısından temel itiraz noktası",
-            "Kaynak ve delil otoritesi meselesi",
-            "Mantıksal tutarlılık ve iç çelişkiler",
-            "Tarihsel köken ve felsefi etkilenmeler",
-            "Pratik sonuçlar ve günlük hayata yansıması"
-        ]
-        research_text = "Araştırma yapılamadı, genel konularla devam ediliyor."
-    
     return research_text, topics
 
+def start_speculative_research(session: MunazaraSession):
+    """Pozisyonlar belli olunca konu sorusunu beklemeden taslak araştırma başlat"""
+    if not SPECULATIVE_RESEARCH or not providers or session.draft_research:
+        return
+    
+    # Bu çift kütüphanede bir konuyla zaten varsa muhtemelen gerek yok
+    pair = TopicLibrary.make_key(session.user_position, session.bot_position, "")[:2]
+    if not topic_library.loaded:
+        topic_library.load()
+    if any(key[:2] == pair for key in topic_library.entries):
+        return
+    
+    # Sadece boş kapasite varsa - gerçek istekler için limiti harcama
+    if not providers[0].has_headroom(SPECULATIVE_MIN_HEADROOM):
+        logger.info("Spekülatif araştırma atlandı (kapasite yetersiz)")
+        return
+    
+    snapshot = MunazaraSession(
+        chat_id=session.chat_id,
+        user_position=session.user_position,
+        bot_position=session.bot_position,
+        topic="genel"
+    )
+    session.draft_research = asyncio.create_task(research_topics(snapshot))
+    logger.info(f"Spekülatif araştırma başladı: {session.user_position} vs {session.bot_position}")
+
+async def await_draft_research(draft: asyncio.Task) -> Tuple[str, List[str]]:
+    """Taslak araştırmanın sonucunu bekle; başarısızsa boş"""
+    try:
+        return await asyncio.wait_for(asyncio.shield(draft), RESEARCH_BUDGET)
+    except asyncio.TimeoutError:
+        draft.cancel()
+        return "", []
+    except asyncio.CancelledError:
+        if not draft.cancelled():
+            raise  # bekleyen görev iptal edildi
+        return "", []
+    except Exception as e:
+        logger.warning(f"Spekülatif araştırma hatası: {e}")
+        return "", []
+
+async def do_research(session: MunazaraSession) -> Tuple[str, List[str]]:
+    """Konu başlıkları: kütüphanede varsa anında, yoksa canlı araştırma ile"""
+    
+    draft, session.draft_research = session.draft_research, None
+    
+    # Taslak artık oturumda değil; cancel_session_work ona ulaşamaz, iptali buradan geçir
+    try:
+        entry = topic_library.lookup(session.user_position, session.bot_position, session.topic)
+        if entry:
+            logger.info(f"Konular kütüphaneden ({entry['source']}): {session.user_position} vs {session.bot_position}")
+            if draft:
+                draft.cancel()
+            if topic_library.needs_refresh(entry):
+                schedule_library_refresh(session)
+            topics = list(entry["topics"])
+            return "\n".join(f"KONU: {t}" for t in topics), topics
+        
+        research_text, topics = "", []
+        if draft and normalize_position(session.topic) in map(normalize_position, SETUP_TOPIC_CATEGORIES):
+            # Genel konu seçildi - taslak araştırma aynen kullanılabilir
+            research_text, topics = await await_draft_research(draft)
+            if topics:
+                logger.info(f"Spekülatif araştırma kullanıldı: {session.user_position} vs {session.bot_position}")
+        
+        if not topics:
+            # Spesifik tez - konuya özel araştırma; taslak sadece yedek
+            research_text, topics = await research_topics(session)
+            if not topics and draft:
+                research_text, topics = await await_draft_research(draft)
+            elif draft:
+                draft.cancel()
+        
+        if topics:
+            topic_library.learn(session.user_position, session.bot_position, session.topic, topics)
+        
+        # Fallback konular - daha anlamlı
+        if not topics:
+            topics = [
+                f"{session.user_position} görüşünün temel tanımı ve sınırları",
+                f"{session.bot_position} açısından temel itiraz noktası",
+                "Kaynak ve delil otoritesi meselesi",
+                "Mantıksal tutarlılık ve iç çelişkiler",
+                "Tarihsel köken ve felsefi etkilenmeler",
+                "Pratik sonuçlar ve günlük hayata yansıması"
+            ]
+            research_text = "Araştırma yapılamadı, genel konularla devam ediliyor."
+        
+        return research_text, topics
+    except asyncio.CancelledError:
+        if draft:
+            draft.cancel()
+        raise
+
 # ============================================
 # NÖBETÇİ LİSTESİ FONKSİYONLARI
 # ============================================
@@ -804,7 +2726,8 @@ async def munazara_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     
     # Yeni oturum oluştur
-    sessions[chat_id] = MunazaraSession(state="SETUP", setup_step=0)
+    cancel_session_work(chat_id)
+    sessions[chat_id] = MunazaraSession(state="SETUP", setup_step=0, chat_id=chat_id)
     
     # İlk soruyu gönder
     await update.message.reply_text(SETUP_QUESTIONS[0], parse_mode="Markdown")
@@ -846,7 +2769,8 @@ Konu: {session.topic}
 _Münazara sonlandırıldı. Yeni münazara için /munazara yazın._"""
     
     # Oturumu sıfırla
-    sessions[chat_id] = MunazaraSession()
+    cancel_session_work(chat_id)
+    sessions[chat_id] = MunazaraSession(chat_id=chat_id)
     
     await update.message.reply_text(summary, parse_mode="Markdown")
 
@@ -859,7 +2783,7 @@ async def durum_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Aktif münazara yok. /munazara ile başlat.")
         return
     
-    gemini_status = "✅" if rate_tracker.can_use_gemini() else "⏳ Limit"
+    api_status = "\n".join(f"{p.label}: {p.status()}" for p in providers)
     
     # Kalan konuları hesapla
     remaining_topics = [t for t in session.attack_topics if t not in session.completed_topics]
@@ -884,15 +2808,21 @@ async def durum_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Kalan: {len(remaining_topics)}
 
 **API Durumu:**
-Gemini: {gemini_status} ({rate_tracker.requests_today}/250 günlük)
-OpenRouter: ✅ Yedek hazır"""
+{api_status}
+Hedge: {hedge_stats['fired']} tetiklendi / {hedge_stats['won']} kazandı
+
+**LLM Kuyruğu:** {llm_scheduler.describe()}
+**Önbellek:** {response_cache.describe()}
+**Önek tekrarı:** {prefix_meter.describe()}
+**Konu kütüphanesi:** {topic_library.describe()}"""
     
-    await update.message.reply_text(msg, parse_mode="Markdown")
+    await send_markdown(update, msg)
 
 async def sifirla_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/sifirla - Oturumu sıfırla"""
     chat_id = update.effective_chat.id
-    sessions[chat_id] = MunazaraSession()
+    cancel_session_work(chat_id)
+    sessions[chat_id] = MunazaraSession(chat_id=chat_id)
     await update.message.reply_text("🔄 Oturum sıfırlandı. /munazara ile yeniden başlayabilirsiniz.")
 
 def format_topics_list(topics: List[str], completed: List[str] = None) -> str:
@@ -909,8 +2839,11 @@ def format_topics_list(topics: List[str], completed: List[str] = None) -> str:
     
     return "\n".join(lines)
 
-async def generate_new_topics(session: MunazaraSession) -> List[str]:
-    """Tüm konular bitince yeni liste oluştur"""
+async def generate_new_topics(session: MunazaraSession, previous: Optional[List[str]] = None) -> List[str]:
+    """Tüm konular bitince yeni liste oluştur (previous: tekrarlanmayacak konular, varsayılan işlenenler)"""
+    if previous is None:
+        previous = session.completed_topics
+    
     research_prompt = f"""Şu iki pozisyon arasında YENİ tartışma konuları bul:
 
 Pozisyon 1 (Savunan): {session.user_position}
@@ -918,7 +2851,7 @@ Pozisyon 2 (Saldıran): {session.bot_position}
 Konu: {session.topic}
 
 ÖNCEKİ KONULAR (bunları TEKRARLAMA):
-{chr(10).join(session.completed_topics)}
+{chr(10).join(previous)}
 
 GÖREV: Farklı, yeni saldırı konuları yaz.
 
@@ -931,22 +2864,14 @@ FORMAT:
     topics = []
     
     try:
-        if gemini_client and rate_tracker.can_use_gemini():
-            response = gemini_client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=research_prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.5,
-                    max_output_tokens=500
-                )
-            )
-            rate_tracker.record_request()
-            
-            for line in response.text.split('\n'):
+        response, _ = await ask_llm(research_prompt, temperature=0.5, max_tokens=500, budget=TOPICS_BUDGET,
+                                    chat_id=session.chat_id, cache=True)
+        if response:
+            for line in response.split('\n'):
                 line = line.strip()
                 if line.startswith('KONU:'):
                     topic = line.replace('KONU:', '').strip()
-                    if topic and topic not in session.completed_topics:
+                    if topic and topic not in previous:
                         topics.append(topic)
     except Exception as e:
         logger.warning(f"Yeni konu üretme hatası: {e}")
@@ -962,6 +2887,37 @@ FORMAT:
     
     return topics
 
+def maybe_prefetch_topics(session: MunazaraSession):
+    """Son konuya gelindiyse sıradaki listeyi arka planda (düşük öncelikle) üret"""
+    remaining = [t for t in session.attack_topics if t not in session.completed_topics]
+    if len(remaining) > 1 or not session.attack_topics or session.next_topics:
+        return
+    
+    # Kalan son konu da tekrarlanmasın
+    previous = session.completed_topics + remaining
+    session.next_topics = asyncio.create_task(generate_new_topics(session, previous))
+    logger.info(f"Sıradaki konu listesi önceden üretiliyor (sohbet {session.chat_id})")
+
+async def take_next_topics(session: MunazaraSession) -> List[str]:
+    """Önceden üretilen listeyi al; yoksa veya başarısızsa şimdi üret"""
+    task, session.next_topics = session.next_topics, None
+    if task:
+        try:
+            topics = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            topics = []
+        except Exception as e:
+            logger.warning(f"Önceden üretilen konular alınamadı: {e}")
+            topics = []
+        
+        topics = [t for t in topics if t not in session.completed_topics]
+        if topics:
+            return topics
+    
+    return await generate_new_topics(session)
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mesaj işleyici"""
     if not update.message or not update.message.text:
@@ -974,7 +2930,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Oturum al veya oluştur
     if chat_id not in sessions:
-        sessions[chat_id] = MunazaraSession()
+        sessions[chat_id] = MunazaraSession(chat_id=chat_id)
     
     session = sessions[chat_id]
     
@@ -1048,10 +3004,15 @@ async def handle_setup(update: Update, context: ContextTypes.DEFAULT_TYPE, sessi
             session.style = "Diyalektik"
     elif step == 4:
         session.topic = message_text
+    session.bump_settings()
     
     # Sonraki adıma geç
     session.setup_step += 1
     
+    # İki pozisyon da belli - kalan sorular cevaplanırken araştırmaya başla
+    if session.setup_step == 2:
+        start_speculative_research(session)
+    
     if session.setup_step < len(SETUP_QUESTIONS):
         # Sonraki soruyu sor
         await update.message.reply_text(
@@ -1059,23 +3020,34 @@ async def handle_setup(update: Update, context: ContextTypes.DEFAULT_TYPE, sessi
             parse_mode="Markdown"
         )
     else:
-        # Setup tamamlandı - araştırma yap
-        await update.message.reply_text("⏳ Ayarlar kaydedildi. Araştırma yapılıyor...")
-        
-        # Web araştırması ve konu başlıkları
-        research_notes, topics = await do_research(session)
-        session.research_notes = research_notes
-        session.attack_topics = topics
-        
-        # Tartışma moduna geç
+        # Setup tamamlandı - araştırma arka planda, tartışma hemen başlar
         session.state = "DISCUSSING"
+        session.research_task = asyncio.create_task(do_research(session))
         
-        bot_mention = f"@{BOT_USERNAME}" if BOT_USERNAME else "botu etiketleyerek"
+        # Kütüphane isabetinde araştırma beklemeden biter; tek adım çalışmasına izin ver
+        await asyncio.sleep(0)
         
-        # Konu listesini formatla
-        topics_text = format_topics_list(topics)
+        if session.research_task.done():
+            await apply_research(session)
+            await send_markdown(update, format_ready_message(session))
+            return
         
-        ready_msg = f"""✅ **Münazara Hazır!**
+        ready = await send_markdown(update, format_ready_message(session))
+        task = asyncio.create_task(finish_research(chat_id, session, ready))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+def format_ready_message(session: MunazaraSession) -> str:
+    """Münazara hazır mesajı (konular henüz yoksa yer tutucu ile)"""
+    bot_mention = f"@{BOT_USERNAME}" if BOT_USERNAME else "botu etiketleyerek"
+    
+    # Konu listesini formatla
+    if session.attack_topics:
+        topics_text = format_topics_list(session.attack_topics)
+    else:
+        topics_text = "⏳ _Konular hazırlanıyor, bu mesaj birazdan güncellenecek..._"
+    
+    return f"""✅ **Münazara Hazır!**
 
 **Pozisyonlar:**
 👤 Siz: {session.user_position}
@@ -1093,17 +3065,74 @@ Konu: {session.topic}
 
 💡 Konu seçmek için: `{bot_mention} konu 2`
 💡 Veya direkt iddianızı söyleyin: `{bot_mention} [iddianız]`"""
-        
-        await update.message.reply_text(ready_msg, parse_mode="Markdown")
+
+async def send_markdown(update: Update, text: str) -> Message:
+    """Markdown mesaj gönder, biçim hatasında düz metin"""
+    try:
+        return await update.message.reply_text(text, parse_mode="Markdown")
+    except Exception:
+        return await update.message.reply_text(text)
+
+async def apply_research(session: MunazaraSession):
+    """Biten araştırmanın sonucunu oturuma yaz"""
+    research_notes, topics = await session.research_task
+    session.research_notes = research_notes
+    session.bump_settings()
+    session.attack_topics = topics
+    session.research_task = None
+
+async def finish_research(chat_id: int, session: MunazaraSession, ready: Message):
+    """Arka plandaki araştırma bitince konuları oturuma ekle ve hazır mesajını güncelle"""
+    try:
+        await apply_research(session)
+    except asyncio.CancelledError:
+        return
+    except Exception as e:
+        logger.error(f"Arka plan araştırma hatası (sohbet {chat_id}): {e}")
+        return
+    
+    # Bu arada oturum sıfırlandıysa eski mesaja dokunma
+    if sessions.get(chat_id) is not session:
+        return
+    
+    text = format_ready_message(session)
+    try:
+        await ready.edit_text(text, parse_mode="Markdown")
+    except Exception:
+        try:
+            await ready.edit_text(text)
+        except Exception as e:
+            logger.warning(f"Hazır mesajı güncellenemedi: {e}")
+
+# Tartışmada akışı değiştiren kontrol mesajları
+TOPIC_PICK_PATTERN = re.compile(r'konu\s*(\d+)')
+# Tam kelime: "geçen", "geçmiş", "pesimist" gibi kelimeler kontrol mesajı sayılmaz
+AGREE_PATTERN = re.compile(r'\b(?:haklısın(?:ız)?|haklisin(?:iz)?|pes)\b|1️⃣')
+SKIP_PATTERN = re.compile(r'\b(?:geç|geçelim)\b|3️⃣')
+
+def is_control_message(text_lower: str) -> bool:
+    """Konu seçimi, 'haklısın' veya 'geç' mesajı mı"""
+    return bool(
+        TOPIC_PICK_PATTERN.match(text_lower)
+        or AGREE_PATTERN.search(text_lower)
+        or SKIP_PATTERN.search(text_lower)
+    )
 
 async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE, session: MunazaraSession, message_text: str, user_name: str):
     """Tartışma mesajlarını işle"""
     
     # Özel komutları kontrol et
     text_lower = message_text.lower().strip()
+    is_claim = True  # bot mesajı yeniden yazarsa iddia defterine girmez
     
     # "konu X" tespiti
-    konu_match = re.match(r'konu\s*(\d+)', text_lower)
+    konu_match = TOPIC_PICK_PATTERN.match(text_lower)
+    if konu_match and not session.attack_topics:
+        await update.message.reply_text(
+            "⏳ Konular hâlâ hazırlanıyor. Bu arada iddianızı doğrudan yazabilirsiniz.",
+            reply_to_message_id=update.message.message_id
+        )
+        return
     if konu_match:
         konu_no = int(konu_match.group(1))
         if 1 <= konu_no <= len(session.attack_topics):
@@ -1118,6 +3147,7 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
             
             # Bu konuyla başla
             message_text = f"'{selected_topic}' konusunda bana saldır."
+            is_claim = False
         else:
             await update.message.reply_text(
                 f"❌ Geçersiz konu numarası. 1-{len(session.attack_topics)} arası seçin.",
@@ -1126,7 +3156,7 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
             return
     
     # "haklısın" tespiti
-    if any(phrase in text_lower for phrase in ["haklısın", "haklısin", "pes", "1️⃣"]):
+    if AGREE_PATTERN.search(text_lower):
         # Nokta kazanıldı
         if session.chat_history:
             last_point = session.chat_history[-1].get("content", "")[:50] + "..."
@@ -1134,8 +3164,17 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
         
         session.turn_count = 0
         
+        if not session.attack_topics:
+            # Araştırma arka planda sürüyor; konular gelince hazır mesajı güncellenir
+            await update.message.reply_text(
+                "✅ Bu noktayı geçiyorum.\n\n⏳ Konular hâlâ hazırlanıyor. Bu arada yeni iddianızı yazabilirsiniz.",
+                reply_to_message_id=update.message.message_id
+            )
+            return
+        
         # Kalan konuları kontrol et
         remaining = [t for t in session.attack_topics if t not in session.completed_topics]
+        maybe_prefetch_topics(session)
         
         if remaining:
             topics_text = format_topics_list(session.attack_topics, session.completed_topics)
@@ -1147,10 +3186,11 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 parse_mode="Markdown"
             )
         else:
-            # Tüm konular bitti - yeni liste oluştur
-            await update.message.reply_text("⏳ Tüm konular işlendi. Yeni konular oluşturuluyor...")
+            # Tüm konular bitti - yeni liste (önceden hazırlandıysa anında)
+            if not (session.next_topics and session.next_topics.done()):
+                await update.message.reply_text("⏳ Tüm konular işlendi. Yeni konular oluşturuluyor...")
             
-            new_topics = await generate_new_topics(session)
+            new_topics = await take_next_topics(session)
             session.attack_topics = new_topics
             # completed_topics'i sıfırlama - eski konuları hatırla
             
@@ -1163,14 +3203,23 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
         return
     
     # "geç" tespiti
-    if any(phrase in text_lower for phrase in ["geç", "geçelim", "3️⃣"]):
+    if SKIP_PATTERN.search(text_lower):
         if session.chat_history:
             last_point = session.chat_history[-1].get("content", "")[:50] + "..."
             session.points_pending.append(last_point)
         
         session.turn_count = 0
         
+        if not session.attack_topics:
+            # Araştırma arka planda sürüyor; konular gelince hazır mesajı güncellenir
+            await update.message.reply_text(
+                "⏸️ Askıya aldım, not ettim.\n\n⏳ Konular hâlâ hazırlanıyor. Bu arada yeni iddianızı yazabilirsiniz.",
+                reply_to_message_id=update.message.message_id
+            )
+            return
+        
         remaining = [t for t in session.attack_topics if t not in session.completed_topics]
+        maybe_prefetch_topics(session)
         
         if remaining:
             topics_text = format_topics_list(session.attack_topics, session.completed_topics)
@@ -1182,9 +3231,10 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 parse_mode="Markdown"
             )
         else:
-            await update.message.reply_text("⏳ Tüm konular işlendi. Yeni konular oluşturuluyor...")
+            if not (session.next_topics and session.next_topics.done()):
+                await update.message.reply_text("⏳ Tüm konular işlendi. Yeni konular oluşturuluyor...")
             
-            new_topics = await generate_new_topics(session)
+            new_topics = await take_next_topics(session)
             session.attack_topics = new_topics
             
             topics_text = format_topics_list(new_topics)
@@ -1198,20 +3248,91 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
     # "2️⃣ cevap ver" tespiti
     if "2️⃣" in message_text or "cevap ver" in text_lower:
         message_text = "Benim yerime cevap ver ve devam et."
+        is_claim = False
+    
+    if DEBOUNCE_WINDOW > 0:
+        queue_discussion_turn(update, session, message_text, user_name, is_claim)
+        return
+    
+    claims = [(user_name, message_text)] if is_claim else []
+    await run_discussion_turn(update, session, [(user_name, message_text)], claims)
+
+def recall_claims(session: MunazaraSession, message_text: str) -> str:
+    """Yeni mesaja en yakın eski iddiaları prompt notu olarak döndür (ham geçmişte olanlar hariç)"""
+    if CLAIM_RECALL_COUNT <= 0:
+        return ""
+    
+    started = time.perf_counter()
+    before_index = len(session.chat_history) - SUMMARY_KEEP_MESSAGES
+    related = session.claims.search(message_text, CLAIM_RECALL_COUNT, before_index, CLAIM_MIN_TERMS)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if not related:
+        return ""
+    
+    logger.info(f"{len(related)} eski iddia hatırlatıldı ({elapsed_ms:.2f} ms, {len(session.claims.claims)} iddia)")
+    lines = "\n".join(f'- {claim.turn}. turda [{claim.author}]: "{claim.text}"' for claim in related)
+    return (
+        "\n\n(BOT NOTU - kullanıcıya gösterme: daha önce şöyle demişti. "
+        "Yeni mesajla çelişiyorsa \"Ama daha önce şöyle demiştin\" diye yakala.)\n" + lines
+    )
+
+async def run_discussion_turn(update: Update, session: MunazaraSession, messages: List[Tuple[str, str]],
+                              claims: List[Tuple[str, str]]):
+    """
+    Bir veya birden çok (birleştirilmiş) kullanıcı mesajına tek LLM cevabı ver.
+    claims: deftere yazılacak (kullanıcı, metin) - bot'un yeniden yazdığı kontrol mesajları hariç
+    """
     
     # Yazıyor göster
     await update.message.chat.send_action("typing")
     
-    # Geçmişe kullanıcı mesajını ekle
-    session.chat_history.append({"role": "user", "content": f"[{user_name}]: {message_text}"})
+    # Geçmişe kullanıcı mesajını ekle (her mesaj kendi yazarıyla)
+    attributed = "\n".join(f"[{name}]: {text}" for name, text in messages)
+    message_text = messages[0][1] if len(messages) == 1 else attributed
+    
+    # İlgili eski iddiaları getir (bu turun iddiaları tur bitince deftere yazılır)
+    llm_message = message_text + recall_claims(session, message_text)
+    history_index = len(session.chat_history)
+    session.chat_history.append({"role": "user", "content": attributed})
+    
+    # AI cevabı al (akış modunda mesaj kademeli olarak gönderilir)
+    # Ayrı görevde çalışır; kullanıcı konuyu değiştirirse cancel_inflight_turn iptal eder
+    if STREAMING_ENABLED:
+        llm_task = asyncio.create_task(stream_ai_reply(update, session, llm_message))
+    else:
+        llm_task = asyncio.create_task(get_ai_response(session, llm_message))
+    inflight_turns[session.chat_id] = llm_task
     
-    # AI cevabı al
-    response, model_used = await get_ai_response(session, message_text)
+    try:
+        result = await llm_task
+    except asyncio.CancelledError:
+        if not llm_task.cancelled() or inflight_turns.get(session.chat_id) is llm_task:
+            raise  # iptal dışarıdan geldi
+        # Cevapsız kalan kullanıcı mesajını geçmişten çıkar
+        if session.chat_history and session.chat_history[-1]["content"] == attributed:
+            session.chat_history.pop()
+        logger.info(f"Tur iptal edildi, eski cevap gönderilmeyecek (sohbet {session.chat_id})")
+        return
+    finally:
+        if inflight_turns.get(session.chat_id) is llm_task:
+            del inflight_turns[session.chat_id]
+    
+    # Tur iptal edilmedi, kullanıcı mesajı geçmişte kalıyor - iddiaları deftere yaz
+    session.user_turns += 1
+    for name, text in claims:
+        session.claims.add(name, text, session.user_turns, history_index)
+    
+    reply = None
+    if STREAMING_ENABLED:
+        response, model_used, reply = result
+    else:
+        response, model_used = result
     
     # Sadece başarılı yanıtlarda işle
     if model_used != "Yok":
         # Geçmişe bot cevabını ekle
         session.chat_history.append({"role": "assistant", "content": response})
+        maybe_summarize(session)
         
         # Tur sayacı
         session.turn_count += 1
@@ -1220,6 +3341,7 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
         for topic in session.attack_topics:
             if topic.lower() in message_text.lower() and topic not in session.completed_topics:
                 session.completed_topics.append(topic)
+                maybe_prefetch_topics(session)
                 break
         
         # 5 tur kontrolü
@@ -1230,21 +3352,205 @@ async def handle_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE,
     footer = f"\n\n_[{model_used}]_"
     
     try:
-        await update.message.reply_text(
-            response + footer, 
-            parse_mode="Markdown",
-            reply_to_message_id=update.message.message_id
-        )
+        if reply:
+            await reply.edit_text(response + footer, parse_mode="Markdown")
+        else:
+            await update.message.reply_text(
+                response + footer, 
+                parse_mode="Markdown",
+                reply_to_message_id=update.message.message_id
+            )
     except:
-        await update.message.reply_text(
-            response + f"\n\n[{model_used}]",
-            reply_to_message_id=update.message.message_id
-        )
+        if reply:
+            await reply.edit_text(response + f"\n\n[{model_used}]")
+        else:
+            await update.message.reply_text(
+                response + f"\n\n[{model_used}]",
+                reply_to_message_id=update.message.message_id
+            )
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Hata yakalayıcı"""
     logger.error(f"Hata: {context.error}")
 
+# ============================================
+# SOHBET BAŞINA SIRALAMA
+# ============================================
+
+# Sohbet kilitleri: {chat_id: Lock} ve kilidi bekleyen/tutan güncelleme sayısı
+chat_locks: Dict[int, asyncio.Lock] = {}
+chat_lock_users: Dict[int, int] = {}
+
+# Aynı anda çalışan en fazla güncelleme/tur (UPDATE_CONCURRENCY); birleştirilmiş turlar da buradan geçer
+update_slots = asyncio.Semaphore(UPDATE_CONCURRENCY)
+
+@asynccontextmanager
+async def chat_turn(chat_id: int):
+    """Aynı sohbetin güncellemelerini geliş sırasıyla tek tek çalıştır"""
+    lock = chat_locks.setdefault(chat_id, asyncio.Lock())
+    chat_lock_users[chat_id] = chat_lock_users.get(chat_id, 0) + 1
+    try:
+        async with lock:
+            yield
+    finally:
+        chat_lock_users[chat_id] -= 1
+        if not chat_lock_users[chat_id]:
+            # Boşta kalan kilidi at (sözlük sohbet sayısıyla büyümesin)
+            del chat_lock_users[chat_id]
+            del chat_locks[chat_id]
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Sohbetler arası paralel, sohbet içi sıralı güncelleme işleyici.
+    Global sınır sohbet kilidi alındıktan sonra uygulanır; sırasını bekleyen
+    güncellemeler diğer sohbetlerin slotlarını işgal etmez.
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        # PTB'nin kendi semaforu sadece üst sınır; asıl sınır update_slots (flush_after ile ortak)
+        super().__init__(max(256, max_concurrent_updates * 16))
+        self.slots = update_slots
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self.slots:
+                await coroutine
+            return
+        
+        # Kontrol mesajı sırasını beklemeden süren turu iptal etsin
+        if supersedes_turn(update):
+            cancel_inflight_turn(chat.id, update.message.text)
+        
+        async with chat_turn(chat.id):
+            async with self.slots:
+                await coroutine
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+
+# ============================================
+# MESAJ BİRLEŞTİRME (DEBOUNCE)
+# ============================================
+
+@dataclass
+class PendingTurn:
+    """Birleştirilmeyi bekleyen tartışma mesajları"""
+    update: Update  # cevap bu mesaja verilir (en sonuncusu)
+    first_at: float
+    messages: List[Tuple[str, str]] = field(default_factory=list)  # (kullanıcı, metin)
+    claims: List[Tuple[str, str]] = field(default_factory=list)  # iddia defterine girecekler
+    timer: Optional[asyncio.Task] = None
+
+# Sohbet başına bekleyen tur: {chat_id: PendingTurn}
+pending_turns: Dict[int, PendingTurn] = {}
+
+def queue_discussion_turn(update: Update, session: MunazaraSession, message_text: str, user_name: str,
+                          is_claim: bool = True):
+    """Mesajı bekleyen tura ekle; pencere içinde yeni mesaj gelmezse tur cevaplanır"""
+    chat_id = session.chat_id
+    now = time.monotonic()
+    
+    pending = pending_turns.get(chat_id)
+    if pending is None:
+        pending = pending_turns[chat_id] = PendingTurn(update=update, first_at=now)
+    pending.messages.append((user_name, message_text))
+    if is_claim:
+        pending.claims.append((user_name, message_text))
+    pending.update = update
+    
+    if pending.timer:
+        pending.timer.cancel()
+    
+    if len(pending.messages) >= DEBOUNCE_MAX_MESSAGES:
+        delay = 0.0
+    else:
+        delay = max(0.0, min(DEBOUNCE_WINDOW, pending.first_at + DEBOUNCE_MAX_WAIT - now))
+    pending.timer = asyncio.create_task(flush_after(chat_id, session, delay))
+    background_tasks.add(pending.timer)
+    pending.timer.add_done_callback(background_tasks.discard)
+
+async def flush_after(chat_id: int, session: MunazaraSession, delay: float):
+    """Pencere dolunca bekleyen turu sohbet sırasına girerek cevapla"""
+    await asyncio.sleep(delay)
+    pending = pending_turns.pop(chat_id, None)
+    if pending is None:
+        return
+    
+    try:
+        async with chat_turn(chat_id):
+            # Beklerken oturum sıfırlandıysa eski mesajları cevaplama
+            if sessions.get(chat_id) is not session or session.state != "DISCUSSING":
+                return
+            if len(pending.messages) > 1:
+                logger.info(f"{len(pending.messages)} mesaj tek tura birleştirildi (sohbet {chat_id})")
+            async with update_slots:
+                await run_discussion_turn(pending.update, session, pending.messages, pending.claims)
+    except Exception as e:
+        logger.error(f"Birleştirilmiş tur hatası (sohbet {chat_id}): {e}")
+
+def cancel_session_work(chat_id: int):
+    """Oturum bitince/sıfırlanınca bekleyen mesajları ve arka plan işlerini (araştırma, konu ön üretimi) bırak"""
+    discard_pending_turn(chat_id)
+    session = sessions.get(chat_id)
+    if session and session.research_task:
+        session.research_task.cancel()
+    if session and session.draft_research:
+        session.draft_research.cancel()
+    if session and session.next_topics:
+        session.next_topics.cancel()
+    if session and session.summary_task:
+        session.summary_task.cancel()
+
+def discard_pending_turn(chat_id: int):
+    """Oturum sıfırlanınca veya konu değişince bekleyen mesajları at"""
+    pending = pending_turns.pop(chat_id, None)
+    if pending and pending.timer:
+        pending.timer.cancel()
+
+# ============================================
+# ESKİYEN TURLARIN İPTALİ
+# ============================================
+
+# Cevabı beklenen LLM turu: {chat_id: Task}
+inflight_turns: Dict[int, asyncio.Task] = {}
+
+SUPERSEDING_COMMANDS = ("/bitir", "/sifirla", "/munazara")
+
+def cancel_inflight_turn(chat_id: int, reason: str):
+    """Sohbetin süren ve bekleyen turlarını iptal et (cevapları artık geçersiz)"""
+    discard_pending_turn(chat_id)
+    task = inflight_turns.pop(chat_id, None)
+    if task and not task.done():
+        logger.info(f"Süren tur iptal ediliyor (sohbet {chat_id}): {reason}")
+        task.cancel()
+
+def supersedes_turn(update: Update) -> bool:
+    """Mesaj süren turu geçersiz kılıyor mu: sıfırlama komutu veya konu değiştiren kontrol mesajı"""
+    message = update.message
+    if not message or not message.text:
+        return False
+    
+    text = message.text.strip()
+    command = text.split()[0].split("@")[0].lower() if text.startswith("/") else ""
+    if command:
+        return command in SUPERSEDING_COMMANDS
+    
+    if message.chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
+        # Grupta sadece bota yazılan mesajlar dikkate alınır (handle_message ile aynı kural)
+        mention = BOT_USERNAME and f"@{BOT_USERNAME.lower()}" in text.lower()
+        replied = message.reply_to_message and message.reply_to_message.from_user
+        to_bot = replied and BOT_USERNAME and (replied.username or "").lower() == BOT_USERNAME.lower()
+        if not mention and not to_bot:
+            return False
+        if BOT_USERNAME:
+            text = re.sub(re.escape(f"@{BOT_USERNAME}"), "", text, flags=re.IGNORECASE).strip()
+    
+    return is_control_message(text.lower())
+
 # ============================================
 # POST INIT - JobQueue ve Pinned Yükleme
 # ============================================
@@ -1270,9 +3576,29 @@ async def post_init(application: Application):
             name="nobet_gunluk"
         )
         logger.info(f"Nöbet günlük kontrol zamanlandı: {target_time} UTC (08:00 TR)")
+        
+        job_queue.run_repeating(
+            rate_state_checkpoint,
+            interval=RATE_STATE_SAVE_INTERVAL,
+            first=RATE_STATE_SAVE_INTERVAL,
+            name="rate_state"
+        )
+        
+        job_queue.run_repeating(
+            response_cache_checkpoint,
+            interval=RATE_STATE_SAVE_INTERVAL,
+            first=RATE_STATE_SAVE_INTERVAL,
+            name="response_cache"
+        )
     else:
         logger.warning("JobQueue kullanılamıyor! pip install 'python-telegram-bot[job-queue]' gerekli.")
 
+async def post_shutdown(application: Application):
+    """Bot kapanırken çalışır"""
+    save_rate_state()
+    response_cache.save()
+    await close_providers()
+
 # ============================================
 # ANA FONKSİYON
 # ============================================
@@ -1287,13 +3613,22 @@ def main():
     
     # API'leri kur
     setup_gemini()
+    load_rate_state()
     setup_openrouter()
+    setup_providers()
+    response_cache.load()
     
     # Uygulama oluştur
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(ChatUpdateProcessor(UPDATE_CONCURRENCY))
+        .build()
+    )
     
     # Post init ayarla
     app.post_init = post_init
+    app.post_shutdown = post_shutdown
     
     # Handler'ları ekle
     app.add_handler(CommandHandler("start", start_command))
@@ -1313,7 +3648,7 @@ def main():
     
     # Başlat
     logger.info("🎭 Münazara GPT v2 başlatılıyor...")
-    logger.info(f"Gemini: {'✅' if gemini_client else '❌'}")
+    logger.info(f"Gemini: {'✅' if gemini_keys else '❌'} ({len(gemini_keys)} anahtar)")
     logger.info(f"OpenRouter: {'✅' if openrouter_client else '❌'}")
 
     if os.environ.get("KOYEB_PUBLIC_DOMAIN"):